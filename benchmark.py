@@ -0,0 +1,654 @@
+import argparse
+import gc
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from array import array
+
+from gatorTaxi import (HEAP_BACKENDS, AggregateRedBlackTree, Heap_Node, Min_Heap, OutputWriter, RangeCache,
+                       Red_Black_Tree, Ride, RideDispatcher, RidePersistence, convert_text_to_binary, make_dispatcher,
+                       parse_command, read_binary_commands, read_commands, run_command, run_commands, write_rides,
+                       write_snapshot)
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+
+# Results are not part of what we measure, so they are discarded
+NULL_OUTPUT = OutputWriter(os.devnull, None, None)
+
+
+# Build a dispatcher holding `size` pending rides with random costs and durations
+def build_system(size, seed=0, indexed=False):
+    rng = random.Random(seed)
+    dispatcher = RideDispatcher(indexed)
+    for ride_number in rng.sample(range(1, size * 4), size):
+        dispatcher.insert_ride(Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000)))
+    return dispatcher, rng
+
+
+# Measure GetNextRide throughput at a (roughly) constant pending-ride count: every popped ride is
+# replaced by a fresh one so the heap keeps its size while we time the pops
+def bench_get_next_ride(size, ops, seed=0):
+    dispatcher, rng = build_system(size, seed)
+    next_number = size * 4
+    elapsed = 0.0
+    for _ in range(ops):
+        start = time.perf_counter()
+        dispatcher.get_next_ride()
+        elapsed += time.perf_counter() - start
+        dispatcher.insert_ride(Ride(next_number, rng.randint(1, 1000), rng.randint(1, 1000)))
+        next_number += 1
+    return ops / elapsed
+
+
+# Measure the memory held by the heap and the tree, in bytes per pending ride
+def bench_memory(size, seed=0, indexed=False):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dispatcher, _ = build_system(size, seed, indexed)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / size
+
+
+# Time loading `size` rides into an empty dispatcher, one insert_ride at a time versus bulk_load_rides
+def bench_bulk_load(size, seed=0):
+    rng = random.Random(seed)
+    rides = [Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000))
+             for ride_number in rng.sample(range(1, size * 4), size)]
+
+    dispatcher = RideDispatcher()
+    start = time.perf_counter()
+    for ride in rides:
+        dispatcher.insert_ride(ride)
+    insert_seconds = time.perf_counter() - start
+
+    dispatcher = RideDispatcher()
+    start = time.perf_counter()
+    dispatcher.bulk_load_rides(rides)
+    bulk_seconds = time.perf_counter() - start
+    return insert_seconds, bulk_seconds
+
+
+# Measure the latency of Print(low, high) for a narrow range holding about `width` rides
+def bench_range_print(size, width, ops, seed=0):
+    dispatcher, rng = build_system(size, seed)
+    start = time.perf_counter()
+    for _ in range(ops):
+        low = rng.randint(1, size * 4)
+        write_rides(dispatcher.iter_rides_in_range(low, low + width * 4), NULL_OUTPUT)
+    return (time.perf_counter() - start) / ops
+
+
+# Measure point operation throughput: Print(n) lookups, then UpdateTrip calls that take the cheap
+# decrease-key branch, then CancelRide of existing rides
+def bench_point_ops(size, ops, seed=0, indexed=False):
+    dispatcher, rng = build_system(size, seed, indexed)
+    ride_numbers = [ride.rideNumber for ride in dispatcher.iter_rides_in_range(0, size * 4)]
+    targets = [rng.choice(ride_numbers) for _ in range(ops)]
+    results = []
+
+    start = time.perf_counter()
+    for ride_number in targets:
+        dispatcher.get_ride(ride_number)
+    results.append(ops / (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for ride_number in targets:
+        dispatcher.update_ride(ride_number, dispatcher.get_ride(ride_number).tripDuration)
+    results.append(ops / (time.perf_counter() - start))
+
+    targets = rng.sample(ride_numbers, min(ops, size))
+    start = time.perf_counter()
+    for ride_number in targets:
+        dispatcher.cancel_ride(ride_number)
+    results.append(len(targets) / (time.perf_counter() - start))
+    return results
+
+
+# Micro-benchmark of the heap sifts alone, without the tree: pop-and-reinsert cycles (a full top-down and a
+# bottom-up sift each) and update_element calls that move a ride towards the root
+def bench_sift(size, ops, seed=0):
+    rng = random.Random(seed)
+    heap = Min_Heap()
+    heap.heapify([Heap_Node(Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000)), None, 0)
+                  for ride_number in range(size)])
+    start = time.perf_counter()
+    for _ in range(ops):
+        heap.insert(heap.pop_top_element())
+    cycles = ops / (time.perf_counter() - start)
+
+    indexes = [rng.randint(1, size) for _ in range(ops)]
+    start = time.perf_counter()
+    for index in indexes:
+        heap.update_element(index, heap.heap_list[index].ride.tripDuration - 1)
+    updates = ops / (time.perf_counter() - start)
+    return cycles, updates
+
+
+# Time writing a snapshot of `size` rides and recovering from it, then logging `ops` mutations to the write-ahead
+# log and recovering again, which replays them on top of the snapshot
+def bench_persistence(size, ops, seed=0):
+    rng = random.Random(seed)
+    dispatcher = RideDispatcher()
+    dispatcher.bulk_load_rides([Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000))
+                                for ride_number in rng.sample(range(1, size * 4), size)])
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, "rides.snapshot")
+        wal_path = os.path.join(directory, "rides.wal")
+
+        start = time.perf_counter()
+        write_snapshot(dispatcher, snapshot_path, 1)
+        snapshot_seconds = time.perf_counter() - start
+
+        dispatcher = RideDispatcher()
+        start = time.perf_counter()
+        persistence = RidePersistence(dispatcher, snapshot_path, wal_path, None)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for ride_number in range(size * 4, size * 4 + ops):
+            dispatcher.insert_ride(Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000)))
+            persistence.after_command()
+        log_seconds = time.perf_counter() - start
+        persistence.close()
+
+        start = time.perf_counter()
+        RidePersistence(RideDispatcher(), snapshot_path, wal_path, None).close()
+        recover_seconds = time.perf_counter() - start
+    return size / snapshot_seconds, size / load_seconds, ops / log_seconds, recover_seconds
+
+
+# Yield `count` text command lines of a mixed workload: inserts of fresh rides interleaved with GetNextRide,
+# UpdateTrip, CancelRide and Print commands on rides inserted earlier
+def generate_commands(count, seed=0, max_value=1000):
+    rng = random.Random(seed)
+    next_ride_number = 1
+    for _ in range(count):
+        choice = rng.random()
+        if choice < 0.5 or next_ride_number == 1:
+            yield "Insert(%d,%d,%d)\n" % (next_ride_number, rng.randint(1, max_value), rng.randint(1, max_value))
+            next_ride_number += 1
+        elif choice < 0.6:
+            yield "GetNextRide()\n"
+        elif choice < 0.75:
+            yield "UpdateTrip(%d,%d)\n" % (rng.randrange(1, next_ride_number), rng.randint(1, max_value * 3 // 2))
+        elif choice < 0.85:
+            yield "CancelRide(%d)\n" % rng.randrange(1, next_ride_number)
+        elif choice < 0.95:
+            yield "Print(%d)\n" % rng.randrange(1, next_ride_number)
+        else:
+            low = rng.randrange(1, next_ride_number)
+            yield "Print(%d,%d)\n" % (low, low + 20)
+
+
+# Time parsing alone and a full replay of the same `count` commands, from the text file and from its binary
+# conversion
+def bench_replay(count, seed=0):
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, "commands.txt")
+        binary_path = os.path.join(directory, "commands.bin")
+        with open(text_path, "w") as text_file:
+            text_file.writelines(generate_commands(count, seed))
+        convert_text_to_binary(text_path, binary_path)
+
+        results = []
+        def read_text_commands():
+            with open(text_path) as text_file:
+                yield from read_commands(text_file)
+
+        for label, open_commands in (("text", read_text_commands),
+                                     ("binary", lambda: read_binary_commands(binary_path))):
+            start = time.perf_counter()
+            for _ in open_commands():
+                pass
+            parse_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            run_commands(open_commands(), RideDispatcher(), NULL_OUTPUT)
+            results.append((label, count / parse_seconds, count / (time.perf_counter() - start)))
+    return results
+
+
+# Replay the same `count` commands on a single RideDispatcher and on ShardedDispatchers with 1..max_shards worker
+# processes, checking that every run writes the same output. Costs and durations are drawn from a wide range so
+# that no two rides tie, since ties across shards may be broken differently
+def bench_shards(count, max_shards, seed=0):
+    from gatorTaxiShards import ShardedDispatcher
+
+    commands = [parse_command(line) for line in generate_commands(count, seed, 10 ** 9)]
+    results = []
+    for shard_count in [0] + list(range(1, max_shards + 1)):
+        dispatcher = ShardedDispatcher(shard_count, count) if shard_count else RideDispatcher()
+        output = io.StringIO()
+        start = time.perf_counter()
+        run_commands(iter(commands), dispatcher, output)
+        elapsed = time.perf_counter() - start
+        if shard_count:
+            dispatcher.close()
+        results.append((shard_count, count / elapsed, output.getvalue()))
+    return [(shard_count, rate, text == results[0][2]) for shard_count, rate, text in results]
+
+
+# Time removing `count` rides with one batch command versus the equivalent single-ride commands: GetNextRides(count)
+# against count GetNextRide commands, and CancelRange over the rideNumbers of about count rides against a
+# CancelRide for each of them. Every variant starts from the same freshly built system
+def bench_batch(size, count, seed=0):
+    # the rides occupy about a quarter of the rideNumbers
+    dispatcher, _ = build_system(size, seed)
+    cancels = [["CancelRide", [ride.rideNumber]] for ride in dispatcher.iter_rides_in_range(1, count * 4)]
+    variants = [[["GetNextRides", [count]]], [["GetNextRide", []]] * count, [["CancelRange", [1, count * 4]]], cancels]
+    results = []
+    for commands in variants:
+        dispatcher, _ = build_system(size, seed)
+        gc.collect()
+        start = time.perf_counter()
+        for name, ride_details in commands:
+            run_command(name, ride_details, dispatcher, NULL_OUTPUT)
+        results.append(time.perf_counter() - start)
+    return results
+
+
+# Compare the plain tree, which walks the range, with AggregateRedBlackTree on Stats(low, high) over ranges holding
+# about `width` rides, and on the cost of `ops` inserts, which have to keep the aggregates up to date
+def bench_stats(size, width, ops, seed=0):
+    results = []
+    for rbt in (Red_Black_Tree(), AggregateRedBlackTree()):
+        rng = random.Random(seed)
+        dispatcher = RideDispatcher(False, None, rbt)
+        dispatcher.bulk_load_rides([Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000))
+                                    for ride_number in range(1, size * 4, 4)])
+        start = time.perf_counter()
+        for _ in range(ops):
+            low = rng.randrange(size * 4)
+            dispatcher.range_stats(low, low + width * 4)
+        stats_seconds = (time.perf_counter() - start) / ops
+        start = time.perf_counter()
+        for ride_number in rng.sample(range(2, size * 4, 4), min(ops, size)):
+            dispatcher.insert_ride(Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000)))
+        results.append((stats_seconds, min(ops, size) / (time.perf_counter() - start)))
+    return results
+
+
+HOT_RANGES = 8
+
+
+# Time a dashboard-like load of `ops` Print(low, high) commands over a few hot ranges of about `width` rides each,
+# with an UpdateTrip on a random ride after every `prints_per_write` prints, without and with a print cache. Returns
+# the mean seconds per command of both runs and the cache's hit rate
+def bench_print_cache(size, width, ops, prints_per_write, seed=0, hot_ranges=HOT_RANGES, cache_bytes=2 ** 24):
+    results = []
+    for cache in (None, RangeCache(cache_bytes)):
+        rng = random.Random(seed)
+        dispatcher = RideDispatcher()
+        dispatcher.bulk_load_rides([Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000))
+                                    for ride_number in range(1, size + 1)])
+        dispatcher.range_cache = cache
+        lows = [rng.randint(1, max(size - width, 1)) for _ in range(hot_ranges)]
+        start = time.perf_counter()
+        for op in range(ops):
+            if op % (prints_per_write + 1) == prints_per_write:
+                run_command("UpdateTrip", [rng.randint(1, size), rng.randint(1, 1000)], dispatcher, NULL_OUTPUT)
+            else:
+                low = rng.choice(lows)
+                run_command("Print", [low, low + width - 1], dispatcher, NULL_OUTPUT)
+        results.append((time.perf_counter() - start) / ops)
+    return results[0], results[1], cache.hit_rate()
+
+
+# Synthetic workloads. Every workload starts from `size` pending rides with the odd rideNumbers 1, 3, 5, ... and then
+# runs one scenario. The commands are generated lazily against the live dispatcher, so that e.g. an UpdateTrip storm
+# can aim at rides that are still pending and pick new durations that land in each branch of update_ride; the
+# generator only reads the dispatcher, and the same seed always yields the same command stream
+WORKLOAD_SCENARIOS = ["insert-burst", "drain", "update-storm", "decrease-storm", "narrow-print", "wide-print", "mixed"]
+
+
+# Pick a rideNumber from the initial population that is still pending, or None after a few misses
+def pick_pending(dispatcher, size, rng):
+    for _ in range(16):
+        ride_number = rng.randrange(size) * 2 + 1
+        ride = dispatcher.get_ride(ride_number)
+        if ride is not None:
+            return ride
+    return None
+
+
+# Yield `ops` commands of the given scenario as (name, arguments) pairs:
+#   insert-burst   Insert of fresh rides with even rideNumbers scattered over the whole key range
+#   drain          GetNextRide
+#   update-storm   UpdateTrip on pending rides, a third each taking the decrease, the cancel-and-reinsert and the
+#                  cancel branch of update_ride
+#   decrease-storm UpdateTrip on pending rides that only shortens them, the in-place decrease-key branch
+#   narrow-print   Print(low, high) ranges holding about 10 rides
+#   wide-print     Print(low, high) ranges holding about 1% of the rides
+#   mixed          the generate_commands mix: inserts, drains, updates, cancels, point and narrow prints
+def generate_workload(scenario, dispatcher, size, ops, rng, max_value=1000):
+    fresh_ride_number = size * 2 + 1
+    for _ in range(ops):
+        kind = scenario
+        if scenario == "mixed":
+            choice = rng.random()
+            kind = ("insert-burst" if choice < 0.5 else "drain" if choice < 0.6 else "update-storm" if choice < 0.75
+                    else "cancel" if choice < 0.85 else "point-print" if choice < 0.95 else "narrow-print")
+        if kind == "insert-burst":
+            ride_number = rng.randrange(size) * 2 + 2
+            tries = 1
+            while dispatcher.get_ride(ride_number) is not None:
+                if tries == 16:
+                    # the even rideNumbers are (nearly) all taken, continue above the initial key range
+                    ride_number = fresh_ride_number
+                    fresh_ride_number += 1
+                    break
+                ride_number = rng.randrange(size) * 2 + 2
+                tries += 1
+            yield "Insert", [ride_number, rng.randint(1, max_value), rng.randint(1, max_value)]
+        elif kind == "drain":
+            yield "GetNextRide", []
+        elif kind in ("update-storm", "decrease-storm"):
+            ride = pick_pending(dispatcher, size, rng)
+            if ride is None:
+                yield "UpdateTrip", [rng.randrange(size) * 2 + 1, rng.randint(1, max_value)]
+                continue
+            duration = ride.tripDuration
+            branch = 0 if kind == "decrease-storm" else rng.randrange(3)
+            if branch == 0:
+                new_duration = rng.randint(1, duration)
+            elif branch == 1:
+                new_duration = rng.randint(duration + 1, 2 * duration)
+            else:
+                new_duration = rng.randint(2 * duration + 1, 3 * duration + 1)
+            yield "UpdateTrip", [ride.rideNumber, new_duration]
+        elif kind == "cancel":
+            yield "CancelRide", [rng.randrange(size) * 2 + 1]
+        elif kind == "point-print":
+            yield "Print", [rng.randrange(size * 2) + 1]
+        else:
+            # the initial rides hold every other rideNumber, so a span of 2k numbers holds about k rides
+            span = 20 if kind == "narrow-print" else max(size // 50, 20)
+            low = rng.randrange(max(size * 2 - span, 1)) + 1
+            yield "Print", [low, low + span - 1]
+
+
+# Run one workload and return its measurements. Each command is timed on its own; generating the next command is
+# not part of the timing
+def run_workload(scenario, size, ops, seed=0, heap="binary"):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    dispatcher = make_dispatcher(heap=heap)
+    dispatcher.bulk_load_rides([Ride(ride_number, rng.randint(1, 1000), rng.randint(1, 1000))
+                                for ride_number in range(1, size * 2, 2)])
+    setup_seconds = time.perf_counter() - start
+
+    timings = {}
+    perf_counter = time.perf_counter
+    elapsed = 0.0
+    for name, ride_details in generate_workload(scenario, dispatcher, size, ops, rng):
+        start = perf_counter()
+        run_command(name, ride_details, dispatcher, NULL_OUTPUT)
+        seconds = perf_counter() - start
+        elapsed += seconds
+        key = "Print(range)" if name == "Print" and len(ride_details) > 1 else name
+        if key not in timings:
+            timings[key] = array("d")
+        timings[key].append(seconds)
+
+    per_operation = {}
+    for key, samples in sorted(timings.items()):
+        samples = sorted(samples)
+        per_operation[key] = {
+            "count": len(samples),
+            "mean_us": sum(samples) / len(samples) * 1e6,
+            "p50_us": samples[len(samples) // 2] * 1e6,
+            "p99_us": samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1e6,
+            "max_us": samples[-1] * 1e6,
+        }
+    return {
+        "scenario": scenario,
+        "heap": heap,
+        "size": size,
+        "ops": ops,
+        "setup_seconds": setup_seconds,
+        "seconds": elapsed,
+        "ops_per_sec": ops / elapsed if elapsed else None,
+        "pending_after": len(dispatcher),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "per_operation": per_operation,
+    }
+
+
+def workload_process(connection, scenario, size, ops, seed, heap):
+    connection.send(run_workload(scenario, size, ops, seed, heap))
+    connection.close()
+
+
+# Run every scenario at every size on every heap backend, each in a fresh process so that its peak RSS is its own.
+# The backends see the same command stream for the same scenario, size and seed
+def bench_workloads(scenarios, sizes, ops, seed=0, heaps=("binary",)):
+    results = []
+    for size in sizes:
+        for scenario in scenarios:
+            # wide prints emit 1% of the rides each, far more work per command than the other scenarios
+            scenario_ops = max(ops // 100, 1) if scenario == "wide-print" else ops
+            for heap in heaps:
+                parent_connection, child_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=workload_process,
+                                                  args=(child_connection, scenario, size, scenario_ops, seed, heap))
+                process.start()
+                child_connection.close()
+                results.append(parent_connection.recv())
+                process.join()
+    return results
+
+
+def run_get_next(args):
+    print("GetNextRide throughput")
+    print("%12s %14s" % ("pending", "ops/sec"))
+    for size in args.sizes:
+        print("%12d %14.0f" % (size, bench_get_next_ride(size, args.ops, args.seed)))
+
+
+def run_memory(args):
+    print("Memory per pending ride")
+    print("%12s %14s" % ("pending", "bytes/ride"))
+    for size in args.sizes:
+        print("%12d %14.1f" % (size, bench_memory(size, args.seed)))
+
+
+def run_bulk_load(args):
+    print("Startup time loading pending rides")
+    print("%12s %14s %14s %10s" % ("rides", "insert_ride s", "bulk load s", "speedup"))
+    for size in args.sizes:
+        insert_seconds, bulk_seconds = bench_bulk_load(size, args.seed)
+        print("%12d %14.3f %14.3f %9.1fx" % (size, insert_seconds, bulk_seconds, insert_seconds / bulk_seconds))
+
+
+def run_range(args):
+    print("Print(low, high) latency, about %d rides per range" % args.width)
+    print("%12s %14s" % ("pending", "usec/print"))
+    for size in args.sizes:
+        print("%12d %14.1f" % (size, bench_range_print(size, args.width, args.ops, args.seed) * 1e6))
+
+
+def run_index(args):
+    print("Tree-only versus hash-indexed point operations")
+    print("%12s %8s %12s %12s %12s %12s" % ("pending", "mode", "bytes/ride", "Print(n)/s", "Update/s", "Cancel/s"))
+    for size in args.sizes:
+        for indexed in (False, True):
+            memory = bench_memory(size, args.seed, indexed)
+            lookups, updates, cancels = bench_point_ops(size, args.ops, args.seed, indexed)
+            print("%12d %8s %12.1f %12.0f %12.0f %12.0f" % (size, "index" if indexed else "tree", memory,
+                                                             lookups, updates, cancels))
+
+
+def run_sift(args):
+    print("Heap sift micro-benchmark")
+    print("%12s %16s %16s" % ("heap size", "pop+insert/s", "decrease-key/s"))
+    for size in args.sizes:
+        cycles, updates = bench_sift(size, args.ops, args.seed)
+        print("%12d %16.0f %16.0f" % (size, cycles, updates))
+
+
+def run_persistence(args):
+    print("Snapshot and write-ahead log throughput, %d logged inserts" % args.ops)
+    print("%12s %14s %14s %14s %14s" % ("rides", "snapshot/s", "load/s", "logged ops/s", "recovery s"))
+    for size in args.sizes:
+        print("%12d %14.0f %14.0f %14.0f %14.3f" % ((size,) + bench_persistence(size, args.ops, args.seed)))
+
+
+def run_replay(args):
+    print("Replay speed, text versus binary command files")
+    print("%12s %8s %14s %14s" % ("commands", "format", "parsed/s", "replayed/s"))
+    for count in args.sizes:
+        for label, parsed, replayed in bench_replay(count, args.seed):
+            print("%12d %8s %14.0f %14.0f" % (count, label, parsed, replayed))
+
+
+def run_shards(args):
+    print("Sharded dispatcher scaling (0 shards = single process)")
+    print("%12s %8s %14s %10s" % ("commands", "shards", "commands/s", "identical"))
+    for count in args.sizes:
+        for shard_count, rate, identical in bench_shards(count, args.max_shards, args.seed):
+            print("%12d %8d %14.0f %10s" % (count, shard_count, rate, "yes" if identical else "NO"))
+
+
+def run_batch(args):
+    print("Batch removal versus one command per ride")
+    print("%12s %10s %16s %16s %16s %16s" % ("pending", "removed", "GetNextRides s", "GetNextRide s",
+                                             "CancelRange s", "CancelRide s"))
+    for size in args.sizes:
+        for percent in args.percents:
+            count = max(size * percent // 100, 1)
+            timings = bench_batch(size, count, args.seed)
+            print("%12d %10d %16.4f %16.4f %16.4f %16.4f" % ((size, count) + tuple(timings)))
+
+
+def run_stats(args):
+    print("Stats(low, high) over about %d rides, plain tree versus aggregate tree" % args.width)
+    print("%12s %16s %16s %16s %16s" % ("pending", "walk usec", "aggregate usec", "plain inserts/s",
+                                        "agg. inserts/s"))
+    for size in args.sizes:
+        (walk, plain_inserts), (aggregate, aggregate_inserts) = bench_stats(size, args.width, args.ops, args.seed)
+        print("%12d %16.1f %16.1f %16.0f %16.0f" % (size, walk * 1e6, aggregate * 1e6, plain_inserts,
+                                                    aggregate_inserts))
+
+
+def run_print_cache(args):
+    print("Print(low, high) over %d hot ranges of about %d rides, one UpdateTrip per %d prints"
+          % (HOT_RANGES, args.width, args.prints_per_write))
+    print("%12s %16s %16s %10s" % ("pending", "uncached usec", "cached usec", "hit rate"))
+    for size in args.sizes:
+        uncached, cached, hit_rate = bench_print_cache(size, args.width, args.ops, args.prints_per_write, args.seed)
+        print("%12d %16.1f %16.1f %9.1f%%" % (size, uncached * 1e6, cached * 1e6, hit_rate * 100))
+
+
+def run_workload_suite(args):
+    results = bench_workloads(args.scenarios, args.sizes, args.ops, args.seed, args.heaps)
+    print("Synthetic workloads, %d commands each (wide-print %d)" % (args.ops, max(args.ops // 100, 1)))
+    print("%12s %14s %8s %14s %14s" % ("pending", "scenario", "heap", "ops/sec", "peak RSS MiB"))
+    for result in results:
+        print("%12d %14s %8s %14.0f %14.1f" % (result["size"], result["scenario"], result["heap"],
+                                               result["ops_per_sec"] or 0, result["peak_rss_kb"] / 1024))
+    if args.json is not None:
+        report = {
+            "seed": args.seed,
+            "ops": args.ops,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "results": results,
+        }
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+            json_file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gatorTaxi benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    get_next = subparsers.add_parser("getnext", help="GetNextRide throughput as the pending-ride count grows")
+    get_next.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="pending-ride counts")
+    get_next.add_argument("--ops", type=int, default=10000, help="timed operations per size")
+    get_next.set_defaults(run=run_get_next)
+
+    memory = subparsers.add_parser("memory", help="bytes held per pending ride")
+    memory.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="pending-ride counts")
+    memory.set_defaults(run=run_memory)
+
+    bulk_load = subparsers.add_parser("bulkload", help="repeated insert_ride versus bulk_load_rides")
+    bulk_load.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="ride counts")
+    bulk_load.set_defaults(run=run_bulk_load)
+
+    range_print = subparsers.add_parser("range", help="Print(low, high) latency as the pending-ride count grows")
+    range_print.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="pending-ride counts")
+    range_print.add_argument("--width", type=int, default=10, help="rides per printed range")
+    range_print.add_argument("--ops", type=int, default=10000, help="timed operations per size")
+    range_print.set_defaults(run=run_range)
+
+    index = subparsers.add_parser("index", help="tree-only versus hash-indexed point operations")
+    index.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="pending-ride counts")
+    index.add_argument("--ops", type=int, default=10000, help="timed operations per size")
+    index.set_defaults(run=run_index)
+
+    sift = subparsers.add_parser("sift", help="heap sift micro-benchmark")
+    sift.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="heap sizes")
+    sift.add_argument("--ops", type=int, default=100000, help="timed operations per size")
+    sift.set_defaults(run=run_sift)
+
+    persistence = subparsers.add_parser("persistence", help="snapshot, log and recovery throughput")
+    persistence.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="ride counts")
+    persistence.add_argument("--ops", type=int, default=100000, help="mutations logged after the snapshot")
+    persistence.set_defaults(run=run_persistence)
+
+    replay = subparsers.add_parser("replay", help="text versus binary command replay")
+    replay.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="command counts")
+    replay.set_defaults(run=run_replay)
+
+    shards = subparsers.add_parser("shards", help="single-process versus sharded multi-process replay")
+    shards.add_argument("--sizes", type=int, nargs="+", default=[10 ** 5], help="command counts")
+    shards.add_argument("--max-shards", type=int, default=os.cpu_count() or 1, help="largest shard count to try")
+    shards.set_defaults(run=run_shards)
+
+    batch = subparsers.add_parser("batch", help="GetNextRides and CancelRange versus one command per ride")
+    batch.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="pending-ride counts")
+    batch.add_argument("--percents", type=int, nargs="+", default=[1, 10, 50, 90],
+                       help="share of the pending rides removed, in percent")
+    batch.set_defaults(run=run_batch)
+
+    stats = subparsers.add_parser("stats", help="Stats(low, high) with and without tree aggregates")
+    stats.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="pending-ride counts")
+    stats.add_argument("--width", type=int, default=1000, help="rides per range")
+    stats.add_argument("--ops", type=int, default=2000, help="timed operations per size")
+    stats.set_defaults(run=run_stats)
+
+    print_cache = subparsers.add_parser("printcache",
+                                        help="hot Print(low, high) ranges with and without a print cache")
+    print_cache.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3], help="pending-ride counts")
+    print_cache.add_argument("--width", type=int, default=1000, help="rides per range")
+    print_cache.add_argument("--ops", type=int, default=5000, help="timed commands per size")
+    print_cache.add_argument("--prints-per-write", type=int, default=100, help="Print commands per UpdateTrip")
+    print_cache.set_defaults(run=run_print_cache)
+
+    workload = subparsers.add_parser("workload", help="seeded synthetic workloads, optionally reported as JSON")
+    workload.add_argument("--scenarios", nargs="+", choices=WORKLOAD_SCENARIOS, default=WORKLOAD_SCENARIOS)
+    workload.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES[:3],
+                          help="initial pending-ride counts, up to 10 ** 7 memory permitting")
+    workload.add_argument("--ops", type=int, default=10000, help="commands per scenario and size")
+    workload.add_argument("--heaps", nargs="+", choices=sorted(HEAP_BACKENDS), default=["binary"],
+                          help="priority queue backends to compare on the same workloads")
+    workload.add_argument("--json", metavar="FILE", help="also write the full results, per-command timings included")
+    workload.set_defaults(run=run_workload_suite)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,38 @@
+import argparse
+import gc
+import heapq
+import mmap
+import os
+import struct
 import sys
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from operator import attrgetter
 
 
 # Class for heap nodes
 class Heap_Node:
+    # __slots__ keeps the per-ride footprint small, there is one Heap_Node for every pending ride
+    __slots__ = ("ride", "rbTree", "min_heap_index", "key")
+
     def __init__(self, ride, rbt, min_heap_index):
-        # a Heap_Node object stores a ride object, a red-black tree object, and the index of the node in the min heap
+        # a Heap_Node object stores a ride object, a red-black tree object, and the index of the node in the min heap;
+        # heaps that are not arrays keep the index at 1 while the node is in the heap
         self.ride = ride
         self.rbTree = rbt
         self.min_heap_index = min_heap_index
+        # the heap ordering key, cached so that sifts compare plain tuples instead of calling Ride.is_less_than;
+        # a <= b on keys is exactly a.ride.is_less_than(b.ride)
+        self.key = (ride.rideCost, ride.tripDuration)
 
 
 # Class for Minheap
+# Every priority queue backend offers the same interface to RideDispatcher: insert, pop_top_element, delete_node,
+# update_node, heapify, peek, top, nodes and current_size, and creates its nodes with node_type
 class Min_Heap:
+    node_type = Heap_Node
+
     def __init__(self):
         # initialize an empty heap list with a dummy element at index 0, and set the current size to 0
         self.heap_list = [0]
@@ -25,38 +46,55 @@ class Min_Heap:
         self.fix_heap_bottom_up(self.current_size)
 
     def fix_heap_bottom_up(self, heap_element_index):
-        # starting from the given node index heap_element_index, swap the node with its parent if its key is less than
-        # its parent's key, and repeat the process until the node's key is greater than or equal to its parent's key
-        while (heap_element_index // 2) > 0:
-            if self.heap_list[heap_element_index].ride.is_less_than(self.heap_list[heap_element_index // 2].ride):
-                self.swap(heap_element_index, (heap_element_index // 2))
+        # starting from the given node index heap_element_index, move the node up past every parent whose key is
+        # greater than or equal to its own. Parents are shifted down into the hole and the node is written once at
+        # its final slot, which is equivalent to swapping at every step but does a fraction of the work
+        heap_list = self.heap_list
+        node = heap_list[heap_element_index]
+        key = node.key
+        while heap_element_index > 1:
+            parent_index = heap_element_index // 2
+            parent = heap_list[parent_index]
+            if key <= parent.key:
+                heap_list[heap_element_index] = parent
+                parent.min_heap_index = heap_element_index
+                heap_element_index = parent_index
             else:
                 break
-            heap_element_index = heap_element_index // 2
+        heap_list[heap_element_index] = node
+        node.min_heap_index = heap_element_index
 
     def swap(self, index1, index2):
         self.heap_list[index1], self.heap_list[index2] = self.heap_list[index2], self.heap_list[index1]
         self.heap_list[index1].min_heap_index, self.heap_list[index2].min_heap_index = index1, index2
 
     def fix_heap_top_down(self, heap_element_index):
-        # starting from the given node index heap_element_index, repeatedly swap it with its minimum child until it
-        # is less than both of its children, or until it reaches a leaf node
-        while (heap_element_index * 2) <= self.current_size:
-            ind = self.get_min_child_index(heap_element_index)
-            if not self.heap_list[heap_element_index].ride.is_less_than(self.heap_list[ind].ride):
-                self.swap(heap_element_index, ind)
-            heap_element_index = ind
-
-    def get_min_child_index(self, heap_element_index):
-        # return the index of the minimum child of the node at the given index heap_element_index
-        if (heap_element_index * 2) + 1 > self.current_size:
-            return heap_element_index * 2
-        else:
-            if self.heap_list[heap_element_index * 2].ride.is_less_than(
-                    self.heap_list[(heap_element_index * 2) + 1].ride):
-                return heap_element_index * 2
+        # starting from the given node index heap_element_index, move the node down past its minimum child until it
+        # is less than both of its children, or until it reaches a leaf node; children are shifted up into the hole
+        # the same way fix_heap_bottom_up shifts parents down
+        size = self.current_size
+        if heap_element_index > size:
+            return
+        heap_list = self.heap_list
+        node = heap_list[heap_element_index]
+        key = node.key
+        child_index = heap_element_index * 2
+        while child_index <= size:
+            # pick the minimum child, the left one on ties
+            child = heap_list[child_index]
+            if child_index < size and heap_list[child_index + 1].key < child.key:
+                child_index += 1
+                child = heap_list[child_index]
+            if key > child.key:
+                heap_list[heap_element_index] = child
+                child.min_heap_index = heap_element_index
+                heap_element_index = child_index
+                child_index = heap_element_index * 2
             else:
-                return (heap_element_index * 2) + 1
+                # the subtree below is already a heap, so the node has settled
+                break
+        heap_list[heap_element_index] = node
+        node.min_heap_index = heap_element_index
 
     def update_element(self, heap_element_index, new_key):
         # update the key of the node at the given index heap_element_index to the given new_key, and perform either
@@ -64,9 +102,10 @@ class Min_Heap:
         # parent's key
         node = self.heap_list[heap_element_index]
         node.ride.tripDuration = new_key
+        node.key = (node.ride.rideCost, new_key)
         if heap_element_index == 1:
             self.fix_heap_top_down(heap_element_index)
-        elif self.heap_list[heap_element_index // 2].ride.is_less_than(self.heap_list[heap_element_index].ride):
+        elif self.heap_list[heap_element_index // 2].key <= node.key:
             self.fix_heap_top_down(heap_element_index)
         else:
             self.fix_heap_bottom_up(heap_element_index)
@@ -75,9 +114,55 @@ class Min_Heap:
         # Replace element with last element in heap and remove last element
         self.swap(heap_element_index, self.current_size)
         self.current_size -= 1
-        *self.heap_list, _ = self.heap_list
-        # Fix heap property
-        self.fix_heap_top_down(heap_element_index)
+        self.heap_list.pop()
+        # Fix heap property, in both directions since the moved last element may be smaller than its new parent
+        if heap_element_index <= self.current_size:
+            self.fix_heap_bottom_up(heap_element_index)
+            self.fix_heap_top_down(heap_element_index)
+
+    def heapify(self, heap_nodes):
+        # build the heap from an arbitrary list of nodes in O(n) by sifting down every internal node, starting from
+        # the last one; this replaces whatever the heap held before
+        self.heap_list = [0] + heap_nodes
+        self.current_size = len(heap_nodes)
+        for index in range(1, self.current_size + 1):
+            self.heap_list[index].min_heap_index = index
+        for index in range(self.current_size // 2, 0, -1):
+            self.fix_heap_top_down(index)
+
+    # Return the nodes of the k smallest keys in order, without modifying the heap. Starting from the root, a
+    # frontier of candidates is kept in a small auxiliary heap: taking the smallest candidate makes its two children
+    # candidates, so only O(k) nodes are ever looked at and the whole walk costs O(k log k)
+    def peek(self, k):
+        heap_list = self.heap_list
+        size = self.current_size
+        nodes = []
+        frontier = [(heap_list[1].key, 1)] if size and k > 0 else []
+        while frontier:
+            _, index = heapq.heappop(frontier)
+            nodes.append(heap_list[index])
+            if len(nodes) == k:
+                break
+            child_index = index * 2
+            if child_index <= size:
+                heapq.heappush(frontier, (heap_list[child_index].key, child_index))
+                if child_index < size:
+                    heapq.heappush(frontier, (heap_list[child_index + 1].key, child_index + 1))
+        return nodes
+
+    # The node with the smallest key, or None when the heap is empty
+    def top(self):
+        return self.heap_list[1] if self.current_size else None
+
+    # A list of every node in the heap, in no particular order
+    def nodes(self):
+        return self.heap_list[1:]
+
+    def delete_node(self, node):
+        self.delete_element(node.min_heap_index)
+
+    def update_node(self, node, new_key):
+        self.update_element(node.min_heap_index, new_key)
 
     def pop_top_element(self):
         # Return 'No Rides Available' if heap is empty
@@ -87,14 +172,251 @@ class Min_Heap:
         root = self.heap_list[1]
         self.swap(1, self.current_size)
         self.current_size -= 1
-        *self.heap_list, _ = self.heap_list
+        # list.pop() drops the last slot in O(1), unlike unpacking which copies the whole list
+        self.heap_list.pop()
         # Fix heap property
         self.fix_heap_top_down(1)
         return root
 
 
+# A d-ary array heap, by default 4-ary: a shallower tree than the binary heap, so inserts and decrease-key updates
+# climb fewer levels, while each level of a sift-down compares more children. Slots are 1-based like in Min_Heap;
+# the children of slot i are the slots (i - 1) * arity + 2 up to (i - 1) * arity + arity + 1
+class DAryHeap(Min_Heap):
+    def __init__(self, arity=4):
+        super().__init__()
+        self.arity = arity
+
+    def fix_heap_bottom_up(self, heap_element_index):
+        heap_list = self.heap_list
+        arity = self.arity
+        node = heap_list[heap_element_index]
+        key = node.key
+        while heap_element_index > 1:
+            parent_index = (heap_element_index - 2) // arity + 1
+            parent = heap_list[parent_index]
+            if key <= parent.key:
+                heap_list[heap_element_index] = parent
+                parent.min_heap_index = heap_element_index
+                heap_element_index = parent_index
+            else:
+                break
+        heap_list[heap_element_index] = node
+        node.min_heap_index = heap_element_index
+
+    def fix_heap_top_down(self, heap_element_index):
+        size = self.current_size
+        if heap_element_index > size:
+            return
+        heap_list = self.heap_list
+        arity = self.arity
+        node = heap_list[heap_element_index]
+        key = node.key
+        first_child_index = (heap_element_index - 1) * arity + 2
+        while first_child_index <= size:
+            # pick the minimum child, the leftmost one on ties
+            child_index = first_child_index
+            child = heap_list[child_index]
+            for index in range(first_child_index + 1, min(first_child_index + arity, size + 1)):
+                if heap_list[index].key < child.key:
+                    child_index = index
+                    child = heap_list[index]
+            if key > child.key:
+                heap_list[heap_element_index] = child
+                child.min_heap_index = heap_element_index
+                heap_element_index = child_index
+                first_child_index = (heap_element_index - 1) * arity + 2
+            else:
+                break
+        heap_list[heap_element_index] = node
+        node.min_heap_index = heap_element_index
+
+    def update_element(self, heap_element_index, new_key):
+        node = self.heap_list[heap_element_index]
+        node.ride.tripDuration = new_key
+        node.key = (node.ride.rideCost, new_key)
+        if heap_element_index == 1 or \
+                self.heap_list[(heap_element_index - 2) // self.arity + 1].key <= node.key:
+            self.fix_heap_top_down(heap_element_index)
+        else:
+            self.fix_heap_bottom_up(heap_element_index)
+
+    def heapify(self, heap_nodes):
+        self.heap_list = [0] + heap_nodes
+        self.current_size = len(heap_nodes)
+        for index in range(1, self.current_size + 1):
+            self.heap_list[index].min_heap_index = index
+        # sift down every node with children, from the last one, which is the parent of the last slot
+        for index in range((self.current_size - 2) // self.arity + 1, 0, -1):
+            self.fix_heap_top_down(index)
+
+    def peek(self, k):
+        heap_list = self.heap_list
+        size = self.current_size
+        arity = self.arity
+        nodes = []
+        frontier = [(heap_list[1].key, 1)] if size and k > 0 else []
+        while frontier:
+            _, index = heapq.heappop(frontier)
+            nodes.append(heap_list[index])
+            if len(nodes) == k:
+                break
+            first_child_index = (index - 1) * arity + 2
+            for child_index in range(first_child_index, min(first_child_index + arity, size + 1)):
+                heapq.heappush(frontier, (heap_list[child_index].key, child_index))
+        return nodes
+
+
+# Heap node of a PairingHeap, linked to its first child and next sibling; prev is the previous sibling, or the
+# parent for a first child
+class PairingHeapNode(Heap_Node):
+    __slots__ = ("child", "sibling", "prev")
+
+    def __init__(self, ride, rbt, min_heap_index):
+        super().__init__(ride, rbt, min_heap_index)
+        self.child = None
+        self.sibling = None
+        self.prev = None
+
+
+# A pairing heap: a tree of nodes whose children are never smaller than their parent. Insert and decrease-key only
+# meld a single node with the root in O(1); the work is deferred to pop_top_element, which merges the root's
+# children in two passes in O(log n) amortized time
+class PairingHeap:
+    node_type = PairingHeapNode
+
+    def __init__(self):
+        self.root = None
+        self.current_size = 0
+
+    # Meld two detached trees and return the new root; on equal keys the first tree stays on top
+    def __meld(self, first, second):
+        if second.key < first.key:
+            first, second = second, first
+        second.prev = first
+        second.sibling = first.child
+        if first.child is not None:
+            first.child.prev = second
+        first.child = second
+        return first
+
+    # Detach a node that is not the root, together with its subtree, from its parent and siblings
+    def __cut(self, node):
+        if node.prev.child is node:
+            node.prev.child = node.sibling
+        else:
+            node.prev.sibling = node.sibling
+        if node.sibling is not None:
+            node.sibling.prev = node.prev
+        node.prev = None
+        node.sibling = None
+
+    # Merge a list of sibling trees into one: meld them in pairs from left to right, then meld the pairs into one
+    # tree from right to left
+    def __merge_pairs(self, first):
+        if first is None:
+            return None
+        pairs = []
+        while first is not None:
+            second = first.sibling
+            if second is None:
+                first.prev = None
+                pairs.append(first)
+                break
+            next_first = second.sibling
+            first.prev = first.sibling = second.prev = second.sibling = None
+            pairs.append(self.__meld(first, second))
+            first = next_first
+        root = pairs.pop()
+        while pairs:
+            root = self.__meld(pairs.pop(), root)
+        return root
+
+    def insert(self, element):
+        element.child = element.sibling = element.prev = None
+        element.min_heap_index = 1
+        self.root = element if self.root is None else self.__meld(self.root, element)
+        self.current_size += 1
+
+    def top(self):
+        return self.root
+
+    def pop_top_element(self):
+        if self.root is None:
+            return 'No Rides Available'
+        root = self.root
+        self.root = self.__merge_pairs(root.child)
+        root.child = None
+        self.current_size -= 1
+        return root
+
+    def delete_node(self, node):
+        if node is self.root:
+            self.pop_top_element()
+            return
+        self.__cut(node)
+        subtree = self.__merge_pairs(node.child)
+        node.child = None
+        if subtree is not None:
+            self.root = self.__meld(self.root, subtree)
+        self.current_size -= 1
+
+    # Set the node's tripDuration to new_key. A decrease, the only update RideDispatcher makes in place, cuts the
+    # node's subtree out and melds it with the root; an increase deletes and re-inserts the node
+    def update_node(self, node, new_key):
+        old_key = node.key
+        node.ride.tripDuration = new_key
+        node.key = (node.ride.rideCost, new_key)
+        if node.key <= old_key:
+            if node is not self.root:
+                self.__cut(node)
+                self.root = self.__meld(self.root, node)
+        else:
+            self.delete_node(node)
+            self.insert(node)
+
+    def heapify(self, heap_nodes):
+        self.root = None
+        self.current_size = 0
+        for node in heap_nodes:
+            self.insert(node)
+
+    def nodes(self):
+        nodes = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if node.child is not None:
+                stack.append(node.child)
+            if node.sibling is not None:
+                stack.append(node.sibling)
+        return nodes
+
+    # The k smallest nodes in order. They are popped and then inserted back, which leaves the same nodes in the heap:
+    # a node can have very many children, the root after a run of inserts has all the others, and walking them
+    # best-first would touch every child on every call. Popping merges them once, so this costs O(k log n) amortized
+    def peek(self, k):
+        nodes = []
+        while len(nodes) < k and self.root is not None:
+            nodes.append(self.pop_top_element())
+        for node in nodes:
+            self.insert(node)
+        return nodes
+
+
+# Priority queue backends selectable with --heap
+HEAP_BACKENDS = {
+    "binary": Min_Heap,
+    "4ary": DAryHeap,
+    "pairing": PairingHeap,
+}
+
+
 # Class to represent a node in Red-Black Tree
 class RedBlackTreeNode:
+    __slots__ = ("ride", "parent", "left", "right", "color", "min_heap_node", "size")
+
     def __init__(self, ride, min_heap_node):
         # The ride object stored in the node
         self.ride = ride
@@ -114,19 +436,32 @@ class RedBlackTreeNode:
         # Reference to the corresponding node in the min heap
         self.min_heap_node = min_heap_node
 
+        # Number of nodes in the subtree rooted at this node, which makes rank and select queries O(log n)
+        self.size = 1
+
 
 # Class for red black tree
 class Red_Black_Tree:
-    def __init__(self):
+    node_type = RedBlackTreeNode
+
+    def __init__(self, indexed=False):
         # Creating null node and setting its attributes
-        self.null_node = RedBlackTreeNode(None, None)
+        self.null_node = self.node_type(None, None)
         self.null_node.left = None
         self.null_node.right = None
         self.null_node.color = 0  # Black color
+        self.null_node.size = 0
         self.root = self.null_node
 
+        # Optional hash index from rideNumber to tree node, which makes point lookups O(1) at the cost of one dict
+        # entry per ride. The tree node links to the heap node, so the index also gives the ride's heap slot
+        self.index = {} if indexed else None
+
     # To retrieve the ride with the rideNumber equal to the key
     def get_ride(self, key):
+        if self.index is not None:
+            return self.index.get(key)
+
         temp = self.root
 
         # Iterating through the tree to find the node with rideNumber equal to the key
@@ -140,22 +475,137 @@ class Red_Black_Tree:
 
         return None
 
-    # This method returns a list of rides within a certain price range
-    # It calls the recursive helper function find_rides_in_range
-    # that traverses the tree and adds the relevant rides to the result list
-    def get_rides_in_range(self, low, high):
-        result = []
-        self.find_rides_in_range(self.root, low, high, result)
-        return result
+    # This method returns a list of the rides with rideNumber in [low, high], in rideNumber order, optionally skipping
+    # the first `offset` rides and returning at most `limit` of them
+    def get_rides_in_range(self, low, high, limit=None, offset=0):
+        return list(self.iter_rides_in_range(low, high, limit, offset))
+
+    # This method lazily yields the rides with rideNumber in [low, high] in order. It walks the tree iteratively with
+    # an explicit stack, never descends into a subtree lying entirely outside the range and stops at the first
+    # rideNumber above high, so producing k rides costs O(log n + k)
+    def iter_rides_in_range(self, low, high, limit=None, offset=0):
+        if offset < 0 or (limit is not None and limit < 0):
+            # a page with a negative size or start holds no rides
+            return iter(())
+        rides = map(attrgetter("ride"), self.__walk_range(low, high))
+        if limit is not None or offset:
+            rides = islice(rides, offset, None if limit is None else offset + limit)
+        return rides
+
+    # This method lazily yields the heap nodes of the rides with rideNumber in [low, high], in rideNumber order; by
+    # default those of all the rides
+    def iter_heap_nodes(self, low=float("-inf"), high=float("inf")):
+        return map(attrgetter("min_heap_node"), self.__walk_range(low, high))
+
+    def __walk_range(self, low, high):
+        stack = []
+        node = self.root
+        while stack or node != self.null_node:
+            if node != self.null_node:
+                if node.ride.rideNumber < low:
+                    # the node and its whole left subtree are below the range
+                    node = node.right
+                else:
+                    stack.append(node)
+                    node = node.left
+            else:
+                node = stack.pop()
+                if node.ride.rideNumber > high:
+                    return
+                yield node
+                node = node.right
+
+    # This method returns the number of rides with rideNumber in [low, high] in O(log n), from the subtree sizes
+    # instead of walking the range
+    def count_in_range(self, low, high):
+        if low > high:
+            return 0
+        return self.__count_below(high, True) - self.__count_below(low, False)
+
+    # This method returns the number of rides with rideNumber below key, or at most key when inclusive is set
+    def __count_below(self, key, inclusive):
+        count = 0
+        node = self.root
+        while node != self.null_node:
+            if node.ride.rideNumber < key or (inclusive and node.ride.rideNumber == key):
+                # the node and its whole left subtree are below the key
+                count += node.left.size + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    # This method returns the 1-based position of the ride with the given rideNumber in rideNumber order, or 0 if
+    # there is no such ride
+    def rank(self, key):
+        if self.get_ride(key) is None:
+            return 0
+        return self.__count_below(key, True)
+
+    # This method returns the node of the i-th ride in rideNumber order (1-based), or None if there are fewer rides
+    def select(self, i):
+        node = self.root
+        if i < 1 or i > node.size:
+            return None
+        while True:
+            left_size = node.left.size
+            if i <= left_size:
+                node = node.left
+            elif i == left_size + 1:
+                return node
+            else:
+                i -= left_size + 1
+                node = node.right
 
-    def find_rides_in_range(self, node, low, high, result):
-        if node == self.null_node:
-            return
-        if low < node.ride.rideNumber:
-            self.find_rides_in_range(node.left, low, high, result)
-        if low <= node.ride.rideNumber <= high:
-            result.append(node.ride)
-        self.find_rides_in_range(node.right, low, high, result)
+    # This method returns the number of rides with rideNumber in [low, high] together with the sum, minimum and
+    # maximum of their rideCost and of their tripDuration, or all zeros when there are none. The plain tree walks the
+    # range; AggregateRedBlackTree answers from its subtree aggregates in O(log n)
+    def range_stats(self, low, high):
+        count = sum_cost = sum_duration = 0
+        min_cost = min_duration = float("inf")
+        max_cost = max_duration = float("-inf")
+        for ride in self.iter_rides_in_range(low, high):
+            count += 1
+            sum_cost += ride.rideCost
+            sum_duration += ride.tripDuration
+            min_cost = min(min_cost, ride.rideCost)
+            max_cost = max(max_cost, ride.rideCost)
+            min_duration = min(min_duration, ride.tripDuration)
+            max_duration = max(max_duration, ride.tripDuration)
+        if count == 0:
+            return 0, 0, 0, 0, 0, 0, 0
+        return count, sum_cost, min_cost, max_cost, sum_duration, min_duration, max_duration
+
+    # This method is called with the lowest node whose subtree changed after an insert or delete, before the tree is
+    # rebalanced, and with the node of a ride whose tripDuration was changed in place. Subtree sizes are kept up to
+    # date incrementally, so the plain tree has nothing to do; AggregateRedBlackTree recomputes the path to the root
+    def update_path(self, node):
+        pass
+
+    # This method builds a balanced tree in O(n) from heap nodes sorted by rideNumber, replacing the current contents.
+    # The middle node becomes the root and both halves are built the same way, so every level but the deepest is
+    # full; coloring the nodes on that deepest level red and every other node black satisfies the RBT properties
+    def build_from_sorted(self, heap_nodes):
+        red_depth = len(heap_nodes).bit_length() - 1
+
+        def build(low, high, parent, depth):
+            if low >= high:
+                return self.null_node
+            mid = (low + high) // 2
+            heap_node = heap_nodes[mid]
+            node = self.node_type(heap_node.ride, heap_node)
+            node.parent = parent
+            node.color = 1 if depth == red_depth else 0
+            node.size = high - low
+            node.left = build(low, mid, node, depth + 1)
+            node.right = build(mid + 1, high, node, depth + 1)
+            heap_node.rbTree = node
+            return node
+
+        self.root = build(0, len(heap_nodes), None, 0)
+        if self.index is not None:
+            self.index = {heap_node.ride.rideNumber: heap_node.rbTree for heap_node in heap_nodes}
+        self.root.color = 0
 
     # This method returns the minimum node in the tree
     # It traverses the left child of each node until it finds a leaf node
@@ -182,6 +632,9 @@ class Red_Black_Tree:
             x.parent.right = y
         y.left = x
         x.parent = y
+        # y takes over x's subtree, x keeps what is left of it
+        y.size = x.size
+        x.size = x.left.size + x.right.size + 1
 
     # This method performs a right rotation around a given node x
     # It updates the parent and child relationships of x and y
@@ -201,6 +654,8 @@ class Red_Black_Tree:
             x.parent.left = y
         y.right = x
         x.parent = y
+        y.size = x.size
+        x.size = x.left.size + x.right.size + 1
 
     # This method replaces a node with its child node in a Red-Black Tree (RBT).
     def __replace_node(self, node, child_node):
@@ -219,7 +674,9 @@ class Red_Black_Tree:
 
     def insert(self, ride, min_heap):
         # create a new node with the given ride and min_heap
-        node = RedBlackTreeNode(ride, min_heap)
+        node = self.node_type(ride, min_heap)
+        if self.index is not None:
+            self.index[ride.rideNumber] = node
 
         # set initial node attributes and color to red
         node.parent = None
@@ -232,6 +689,8 @@ class Red_Black_Tree:
         temp_node = self.root
         while temp_node != self.null_node:
             insertion_node = temp_node
+            # the new node will be in the subtree of every node on the way down
+            temp_node.size += 1
             if node.ride.rideNumber < temp_node.ride.rideNumber:
                 temp_node = temp_node.left
             else:
@@ -245,16 +704,18 @@ class Red_Black_Tree:
             insertion_node.right = node
         else:
             insertion_node.left = node
+        self.update_path(insertion_node)
 
         # balance the tree after insertion
         if node.parent is None:
             # if the new node is the root node, color it black
             node.color = 0
-            return
+            return node
         if node.parent.parent is None:
             # if the new node is a child of the root node, no need to balance
-            return
+            return node
         self.insert_balance(node)
+        return node
 
     # Balances the tree after inserting a node
     def insert_balance(self, curr_node):
@@ -300,8 +761,11 @@ class Red_Black_Tree:
     # Deletes a node from the tree and returns the corresponding heap node
     def delete_helper(self, node, key):
 
-        # Traverse the tree to find the node to delete
+        # Find the node to delete, through the index when there is one, otherwise by traversing the tree
         delete_node = self.null_node
+        if self.index is not None:
+            delete_node = self.index.pop(key, self.null_node)
+            node = self.null_node
         while node != self.null_node:
             if node.ride.rideNumber == key:
                 delete_node = node
@@ -319,6 +783,16 @@ class Red_Black_Tree:
         y = delete_node
         y_original_color = y.color
 
+        # Every ancestor of the node that is spliced out of the tree loses one node from its subtree; with two
+        # children that is the successor, which then takes over delete_node's place and (decremented) size
+        spliced = delete_node
+        if delete_node.left != self.null_node and delete_node.right != self.null_node:
+            spliced = self.get_minimum(delete_node.right)
+        ancestor = spliced.parent
+        while ancestor is not None:
+            ancestor.size -= 1
+            ancestor = ancestor.parent
+
         # Handle case where node has at most one child
         if delete_node.left == self.null_node:
             x = delete_node.right
@@ -329,7 +803,7 @@ class Red_Black_Tree:
 
         # Handle case where node has two children
         else:
-            y = self.get_minimum(delete_node.right)
+            y = spliced
             y_original_color = y.color
             x = y.right
             if y.parent == delete_node:
@@ -342,6 +816,9 @@ class Red_Black_Tree:
             y.left = delete_node.left
             y.left.parent = y
             y.color = delete_node.color
+            y.size = delete_node.size
+        # x.parent is now the lowest node whose subtree changed
+        self.update_path(x.parent)
 
         # Balance the tree after deleting the node
         if y_original_color == 0:
@@ -413,7 +890,118 @@ class Red_Black_Tree:
         node.color = 0
 
 
+# Red-black tree node that also holds the sum, minimum and maximum of rideCost and tripDuration over its subtree
+class AggregateTreeNode(RedBlackTreeNode):
+    __slots__ = ("sum_cost", "min_cost", "max_cost", "sum_duration", "min_duration", "max_duration")
+
+    def __init__(self, ride, min_heap_node):
+        super().__init__(ride, min_heap_node)
+        if ride is None:
+            # the null node aggregates no rides
+            self.sum_cost = self.sum_duration = 0
+            self.min_cost = self.min_duration = float("inf")
+            self.max_cost = self.max_duration = float("-inf")
+        else:
+            self.sum_cost = self.min_cost = self.max_cost = ride.rideCost
+            self.sum_duration = self.min_duration = self.max_duration = ride.tripDuration
+
+
+# A red-black tree whose nodes carry subtree aggregates of rideCost and tripDuration, so that range_stats runs in
+# O(log n) without visiting the rides in the range. The aggregates are recomputed along the changed path after
+# every insert, delete and in-place tripDuration update, and for both nodes of every rotation
+class AggregateRedBlackTree(Red_Black_Tree):
+    node_type = AggregateTreeNode
+
+    def __recompute(self, node):
+        left = node.left
+        right = node.right
+        cost = node.ride.rideCost
+        duration = node.ride.tripDuration
+        node.sum_cost = left.sum_cost + right.sum_cost + cost
+        node.min_cost = min(left.min_cost, right.min_cost, cost)
+        node.max_cost = max(left.max_cost, right.max_cost, cost)
+        node.sum_duration = left.sum_duration + right.sum_duration + duration
+        node.min_duration = min(left.min_duration, right.min_duration, duration)
+        node.max_duration = max(left.max_duration, right.max_duration, duration)
+
+    def update_path(self, node):
+        while node is not None:
+            self.__recompute(node)
+            node = node.parent
+
+    def left_rotation(self, x):
+        super().left_rotation(x)
+        # x is now the child of its old right child
+        self.__recompute(x)
+        self.__recompute(x.parent)
+
+    def right_rotation(self, x):
+        super().right_rotation(x)
+        self.__recompute(x)
+        self.__recompute(x.parent)
+
+    def build_from_sorted(self, heap_nodes):
+        super().build_from_sorted(heap_nodes)
+        # recompute children before their parents: the reverse of a pre-order walk
+        order = []
+        stack = [self.root] if self.root != self.null_node else []
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            if node.left != self.null_node:
+                stack.append(node.left)
+            if node.right != self.null_node:
+                stack.append(node.right)
+        for node in reversed(order):
+            self.__recompute(node)
+
+    def range_stats(self, low, high):
+        null_node = self.null_node
+        # find the highest node inside the range, the rest of the range lies in its two subtrees
+        node = self.root
+        while node != null_node:
+            if node.ride.rideNumber < low:
+                node = node.right
+            elif node.ride.rideNumber > high:
+                node = node.left
+            else:
+                break
+        if node == null_node:
+            return 0, 0, 0, 0, 0, 0, 0
+        # the range is made of O(log n) single nodes along the two boundary paths and the whole subtrees hanging
+        # off those paths towards the inside of the range
+        singles = [node]
+        subtrees = []
+        walk = node.left
+        while walk != null_node:
+            if walk.ride.rideNumber >= low:
+                singles.append(walk)
+                subtrees.append(walk.right)
+                walk = walk.left
+            else:
+                walk = walk.right
+        walk = node.right
+        while walk != null_node:
+            if walk.ride.rideNumber <= high:
+                singles.append(walk)
+                subtrees.append(walk.left)
+                walk = walk.right
+            else:
+                walk = walk.left
+        costs = [single.ride.rideCost for single in singles]
+        durations = [single.ride.tripDuration for single in singles]
+        return (len(singles) + sum(subtree.size for subtree in subtrees),
+                sum(costs) + sum(subtree.sum_cost for subtree in subtrees),
+                min(min(costs), min([subtree.min_cost for subtree in subtrees], default=float("inf"))),
+                max(max(costs), max([subtree.max_cost for subtree in subtrees], default=float("-inf"))),
+                sum(durations) + sum(subtree.sum_duration for subtree in subtrees),
+                min(min(durations), min([subtree.min_duration for subtree in subtrees], default=float("inf"))),
+                max(max(durations), max([subtree.max_duration for subtree in subtrees], default=float("-inf"))))
+
+
 class Ride:
+    __slots__ = ("rideNumber", "rideCost", "tripDuration")
+
     def __init__(self, rideNumber, rideCost, tripDuration):
         # initialize a new Ride object with the given rideNumber, rideCost, and tripDuration
         self.rideNumber = rideNumber
@@ -433,144 +1021,1062 @@ class Ride:
             return False
 
 
-# Function to insert a new ride into the system
-def insert_ride(ride, heap, rbt):
-    # Check if the ride number already exists in the system
-    if rbt.get_ride(ride.rideNumber) is not None:
-        output_helper(None, "Duplicate RideNumber", False)
-        # If ride number already exists, exit the program
-        sys.exit(0)
-        return
-    # Create a new Red-Black Tree node and a corresponding Min Heap node
-    rbt_node = RedBlackTreeNode(None, None)
-    min_heap_node = Heap_Node(ride, rbt_node, heap.current_size + 1)
-    # Insert the new nodes into both the heap and the Red-Black Tree
-    heap.insert(min_heap_node)
-    rbt.insert(ride, min_heap_node)
-
-
-# Function to get the next ride request from the system
-def get_next_ride(heap, rbt):
-    # Check if there are any active ride requests in the system
-    if heap.current_size != 0:
+# Raised when a ride is inserted with a rideNumber that is already pending
+class DuplicateRideError(Exception):
+    def __init__(self, ride_number):
+        super().__init__("Duplicate RideNumber")
+        self.ride_number = ride_number
+
+
+# Bulk removals rebuild the structures once the removed rides number at least 1 / BULK_REMOVAL_FACTOR of the pending
+# ones; below that, removing them one at a time is cheaper
+BULK_REMOVAL_FACTOR = 2
+
+
+# Slots per level of a TimerWheel, a power of two so a deadline's slot at every level is a bit field of it
+WHEEL_BITS = 6
+WHEEL_SLOTS = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SLOTS - 1
+
+
+# Hierarchical timer wheel over a logical clock. Slot s of level l holds the entries due in the s-th run of
+# WHEEL_SLOTS ** l ticks of the current level l + 1 slot. An entry is filed in the lowest level whose span covers its
+# deadline and moves down a level when the clock reaches its slot, so scheduling is O(1) and each entry is moved at
+# most once per level before it is due
+class TimerWheel:
+    def __init__(self, levels=4):
+        self.now = 0
+        self.levels = [[[] for _ in range(WHEEL_SLOTS)] for _ in range(levels)]
+        # number of entries filed in each level, so stretches of ticks where nothing can happen are skipped
+        self.level_counts = [0] * levels
+        # entries due beyond the span of the top level, filed again each time the top level wraps around
+        self.overflow = []
+        # entries whose deadline had already passed when they were filed
+        self.due = []
+        self.count = 0
+
+    def schedule(self, deadline, item):
+        self.count += 1
+        self.__file(deadline, item)
+
+    def __file(self, deadline, item):
+        now = self.now
+        if deadline <= now:
+            self.due.append((deadline, item))
+            return
+        shift = 0
+        for level, slots in enumerate(self.levels):
+            if deadline >> (shift + WHEEL_BITS) == now >> (shift + WHEEL_BITS):
+                slots[(deadline >> shift) & WHEEL_MASK].append((deadline, item))
+                self.level_counts[level] += 1
+                return
+            shift += WHEEL_BITS
+        self.overflow.append((deadline, item))
+
+    # Move the clock forward to now and return the (deadline, item) entries that came due on the way
+    def advance(self, now):
+        due = self.due
+        self.due = []
+        if not self.count:
+            # nothing is scheduled, skip the ticks in between
+            self.now = max(self.now, now)
+            return due
+        levels = self.levels
+        level_counts = self.level_counts
+        while self.now < now:
+            # nothing comes due or moves down a level before the next boundary of the lowest level holding entries,
+            # so the clock jumps to just before it
+            lowest = 0
+            while lowest < len(levels) and not level_counts[lowest]:
+                lowest += 1
+            if lowest:
+                self.now = min(now, (self.now | ((1 << (WHEEL_BITS * lowest)) - 1)) + 1) - 1
+            self.now += 1
+            tick = self.now
+            # at a boundary of a higher level, spread that level's current slot over the levels below, top down
+            if not tick & ((1 << (WHEEL_BITS * len(levels))) - 1):
+                overflow = self.overflow
+                self.overflow = []
+                for deadline, item in overflow:
+                    self.__file(deadline, item)
+            for level in range(len(levels) - 1, 0, -1):
+                shift = WHEEL_BITS * level
+                if not tick & ((1 << shift) - 1):
+                    slot = (tick >> shift) & WHEEL_MASK
+                    entries = levels[level][slot]
+                    if entries:
+                        levels[level][slot] = []
+                        level_counts[level] -= len(entries)
+                        for deadline, item in entries:
+                            self.__file(deadline, item)
+            entries = levels[0][tick & WHEEL_MASK]
+            if entries:
+                levels[0][tick & WHEEL_MASK] = []
+                level_counts[0] -= len(entries)
+                due.extend(entries)
+            # the entries filed as due while cascading are due now as well
+            if self.due:
+                due.extend(self.due)
+                self.due = []
+        self.count -= len(due)
+        return due
+
+
+# The ride dispatch engine: owns the min heap (rides ordered by cost, then duration) and the red-black tree (rides
+# ordered by rideNumber) and keeps the two in step. Operations return their results instead of writing them, so
+# the engine can be embedded in a long-running process; formatting the results is left to the caller
+class RideDispatcher:
+    # heap and rbt replace the default empty structures, e.g. with the counting ones of gatorTaxiProfile
+    def __init__(self, indexed=False, heap=None, rbt=None):
+        self.heap = Min_Heap() if heap is None else heap
+        self.rbt = Red_Black_Tree(indexed) if rbt is None else rbt
+        # write-ahead log every mutation is recorded in, see RidePersistence
+        self.wal = None
+        # cache of formatted Print(low, high) results, told about every ride that changes, see RangeCache
+        self.range_cache = None
+        # logical clock, one tick per command, and the expiry timers of rides inserted with a TTL. The timer wheel is
+        # only created by the first such ride; deadlines maps a rideNumber to the deadline of its timer, so a timer
+        # left behind by a ride that was dispatched or cancelled in the meantime is recognised and ignored
+        self.clock = 0
+        self.timers = None
+        self.deadlines = {}
+        self.expired_rides = 0
+        self.expiry_batches = 0
+
+    # Insert a new ride, raising DuplicateRideError if its rideNumber is already pending. A ride with a ttl stays
+    # pending for the next ttl ticks and expires at the one after, see tick
+    def insert_ride(self, ride, ttl=None):
+        if self.rbt.get_ride(ride.rideNumber) is not None:
+            raise DuplicateRideError(ride.rideNumber)
+        # Create a Min Heap node, insert it into the heap and link it to its new Red-Black Tree node
+        min_heap_node = self.heap.node_type(ride, None, self.heap.current_size + 1)
+        self.heap.insert(min_heap_node)
+        min_heap_node.rbTree = self.rbt.insert(ride, min_heap_node)
+        if self.wal is not None:
+            self.wal.append(OP_INSERT, ride.rideNumber, ride.rideCost, ride.tripDuration)
+        if self.range_cache is not None:
+            self.range_cache.invalidate(ride.rideNumber)
+        if ttl is not None:
+            self.expire_at(ride.rideNumber, self.clock + ttl + 1)
+        elif self.timers is not None:
+            # a timer of an earlier ride with this rideNumber must not expire this one
+            self.deadlines.pop(ride.rideNumber, None)
+
+    # Load many rides at once, e.g. when cold-starting from a snapshot of pending rides. Into an empty system the
+    # rides are sorted once, checked for duplicates in the same pass, and then the tree is built directly from the
+    # sorted sequence and the heap is heapified, both in O(n). A duplicate raises DuplicateRideError before
+    # anything is loaded
+    def bulk_load_rides(self, rides):
+        if self.heap.current_size != 0:
+            # the bulk builders replace the structures, so merge into a non-empty system one ride at a time
+            for ride in rides:
+                self.insert_ride(ride)
+            return
+        # no ride is pending, so every timer left belongs to a ride that is gone
+        self.deadlines.clear()
+        if self.range_cache is not None:
+            self.range_cache.clear()
+        # pause the cyclic garbage collector while allocating, it would otherwise rescan the growing set of new
+        # nodes over and over without ever finding garbage
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            heap_nodes = []
+            previous_ride_number = None
+            for ride in sorted(rides, key=attrgetter("rideNumber")):
+                if ride.rideNumber == previous_ride_number:
+                    raise DuplicateRideError(ride.rideNumber)
+                previous_ride_number = ride.rideNumber
+                heap_nodes.append(self.heap.node_type(ride, None, 0))
+            self.rbt.build_from_sorted(heap_nodes)
+            self.heap.heapify(heap_nodes)
+            if self.wal is not None:
+                # the structures were built directly, so the loaded rides are logged here, in rideNumber order
+                for heap_node in heap_nodes:
+                    ride = heap_node.ride
+                    self.wal.append(OP_INSERT, ride.rideNumber, ride.rideCost, ride.tripDuration)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    # Remove and return the cheapest pending ride, or None when there are no active ride requests
+    def get_next_ride(self):
+        if self.heap.current_size == 0:
+            return None
         # Pop the top ride request from the Min Heap and delete its corresponding node from the Red-Black Tree
-        popped_node = heap.pop_top_element()
-        rbt.delete_node(popped_node.ride.rideNumber)
-        output_helper(popped_node.ride, "", False)
-    else:
-        output_helper(None, "No active ride requests", False)
+        popped_node = self.heap.pop_top_element()
+        self.rbt.delete_node(popped_node.ride.rideNumber)
+        if self.wal is not None:
+            # logged as a cancel of the popped ride, so replaying it does not depend on how ties were broken
+            self.wal.append(OP_CANCEL, popped_node.ride.rideNumber)
+        if self.range_cache is not None:
+            self.range_cache.invalidate(popped_node.ride.rideNumber)
+        return popped_node.ride
+
+    # Remove and return up to k of the cheapest pending rides, cheapest first. The rides are popped off the heap one
+    # by one; when they are a large share of the system, the tree is rebuilt from the remaining rides in O(n)
+    # instead of searching for and deleting each of them
+    def get_next_rides(self, k):
+        k = min(k, self.heap.current_size)
+        if k * BULK_REMOVAL_FACTOR < self.heap.current_size:
+            rides = []
+            for _ in range(k):
+                rides.append(self.get_next_ride())
+            return rides
+        popped_nodes = []
+        for _ in range(k):
+            heap_node = self.heap.pop_top_element()
+            # a node in the heap never has index 0, so 0 marks it as removed for __rebuild_tree
+            heap_node.min_heap_index = 0
+            popped_nodes.append(heap_node)
+        self.__rebuild_tree()
+        rides = [heap_node.ride for heap_node in popped_nodes]
+        self.__log_cancels(rides)
+        if self.range_cache is not None:
+            # at least half the rides are gone, hardly any cached range is left untouched
+            self.range_cache.clear()
+        return rides
+
+    # Cancel every pending ride with rideNumber in [low, high] and return the cancelled rides in rideNumber order.
+    # A few rides are cancelled one at a time; when they are a large share of the system, both structures are
+    # rebuilt in O(n) from the remaining rides instead
+    def cancel_range(self, low, high):
+        heap_nodes = list(self.rbt.iter_heap_nodes(low, high))
+        if len(heap_nodes) * BULK_REMOVAL_FACTOR < self.heap.current_size:
+            for heap_node in heap_nodes:
+                self.cancel_ride(heap_node.ride.rideNumber)
+            return [heap_node.ride for heap_node in heap_nodes]
+        for heap_node in heap_nodes:
+            heap_node.min_heap_index = 0
+        self.heap.heapify([heap_node for heap_node in self.heap.nodes() if heap_node.min_heap_index])
+        self.__rebuild_tree()
+        rides = [heap_node.ride for heap_node in heap_nodes]
+        self.__log_cancels(rides)
+        if self.range_cache is not None:
+            self.range_cache.invalidate_range(low, high)
+        return rides
+
+    # Rebuild the tree from the rides still in the heap, dropping those whose heap node was marked removed
+    def __rebuild_tree(self):
+        self.rbt.build_from_sorted([heap_node for heap_node in self.rbt.iter_heap_nodes() if heap_node.min_heap_index])
+
+    def __log_cancels(self, rides):
+        if self.wal is not None:
+            for ride in rides:
+                self.wal.append(OP_CANCEL, ride.rideNumber)
+
+    # Return up to k of the cheapest pending rides, cheapest first, without removing them. Rides with equal cost and
+    # duration may be listed in a different order than GetNextRide would return them
+    def peek_rides(self, k):
+        return [heap_node.ride for heap_node in self.heap.peek(k)]
+
+    # Cancel a ride request, returning the cancelled ride or None if it was not pending
+    def cancel_ride(self, ride_number):
+        # Delete the ride request from the Red-Black Tree and get its corresponding Min Heap node
+        heap_node = self.rbt.delete_node(ride_number)
+        if heap_node is None:
+            return None
+        # Delete the corresponding Min Heap node
+        self.heap.delete_node(heap_node)
+        if self.wal is not None:
+            self.wal.append(OP_CANCEL, ride_number)
+        if self.range_cache is not None:
+            self.range_cache.invalidate(ride_number)
+        return heap_node.ride
+
+    # Update the duration of a ride request, returning False if the ride was not pending
+    def update_ride(self, ride_number, new_duration):
+        # Get the Red-Black Tree node corresponding to the ride request
+        rbt_node = self.rbt.get_ride(ride_number)
+        if rbt_node is None:
+            return False
+        ride = rbt_node.ride
+        if new_duration <= ride.tripDuration:
+            # If the new duration is less than or equal to the current duration, update the Min Heap node accordingly
+            self.heap.update_node(rbt_node.min_heap_node, new_duration)
+            self.rbt.update_path(rbt_node)
+            if self.wal is not None:
+                self.wal.append(OP_UPDATE, ride_number, new_duration)
+            if self.range_cache is not None:
+                self.range_cache.invalidate(ride_number)
+        elif ride.tripDuration < new_duration <= (2 * ride.tripDuration):
+            # If the new duration is between the current duration and twice the current duration, cancel the ride
+            # request and insert a new ride request with the updated duration and cost
+            deadline = self.deadlines.get(ride_number)
+            self.cancel_ride(ride.rideNumber)
+            self.insert_ride(Ride(ride.rideNumber, ride.rideCost + 10, new_duration))
+            if deadline is not None:
+                # the updated ride keeps its TTL, the timer already scheduled for it stays valid
+                self.deadlines[ride_number] = deadline
+                if self.wal is not None:
+                    self.wal.append(OP_EXPIRY, ride_number, deadline)
+        else:
+            # If the new duration is more than twice the current duration, cancel the ride request
+            self.cancel_ride(ride.rideNumber)
+        return True
+
+    # Return the pending ride with the given rideNumber, or None
+    def get_ride(self, ride_number):
+        rbt_node = self.rbt.get_ride(ride_number)
+        return None if rbt_node is None else rbt_node.ride
+
+    # Lazily yield the pending rides with rideNumber in [low, high] in order, see Red_Black_Tree.iter_rides_in_range
+    def iter_rides_in_range(self, low, high, limit=None, offset=0):
+        return self.rbt.iter_rides_in_range(low, high, limit, offset)
+
+    # Number of pending rides with rideNumber in [low, high], in O(log n)
+    def count_rides(self, low, high):
+        return self.rbt.count_in_range(low, high)
+
+    # 1-based position of the ride in rideNumber order, or 0 if it is not pending
+    def rank_ride(self, ride_number):
+        return self.rbt.rank(ride_number)
+
+    # The i-th pending ride in rideNumber order (1-based), or None
+    def select_ride(self, i):
+        rbt_node = self.rbt.select(i)
+        return None if rbt_node is None else rbt_node.ride
+
+    # (count, sum, min and max of rideCost, sum, min and max of tripDuration) over the pending rides with rideNumber
+    # in [low, high]; O(log n) when the dispatcher was built with an AggregateRedBlackTree
+    def range_stats(self, low, high):
+        return self.rbt.range_stats(low, high)
+
+    # Number of pending rides
+    def __len__(self):
+        return self.heap.current_size
+
+    # Every operation is applied before it returns, so there is nothing to wait for; see ShardedDispatcher.sync
+    def sync(self):
+        pass
+
+    # Advance the logical clock by one tick, once per command, and expire the rides whose TTL has run out. Without
+    # rides inserted with a TTL this only counts
+    def tick(self):
+        self.clock += 1
+        if self.timers is not None:
+            if self.wal is not None:
+                self.wal.append(OP_CLOCK, self.clock)
+            self.expire_rides()
+
+    # Move the logical clock forward to now, e.g. a shard catching up with its coordinator, and expire what is due
+    def advance_clock(self, now):
+        self.clock = now
+        if self.timers is not None:
+            if self.wal is not None:
+                self.wal.append(OP_CLOCK, self.clock)
+            self.expire_rides()
+
+    # Expire a pending ride once the logical clock reaches deadline. The first timer starts the wheel at the
+    # current clock, and from then on every tick is logged, so a recovered dispatcher expires the ride on time
+    def expire_at(self, ride_number, deadline):
+        if self.timers is None:
+            self.timers = TimerWheel()
+            self.timers.advance(self.clock)
+            if self.wal is not None:
+                self.wal.append(OP_CLOCK, self.clock)
+        self.deadlines[ride_number] = deadline
+        self.timers.schedule(deadline, ride_number)
+        if self.wal is not None:
+            self.wal.append(OP_EXPIRY, ride_number, deadline)
+
+    # Cancel, in one batch, every ride whose timer came due; timers of rides that are no longer pending, or that
+    # were inserted again since, are dropped
+    def expire_rides(self):
+        due = self.timers.advance(self.clock)
+        if not due:
+            return
+        expired = 0
+        for deadline, ride_number in due:
+            if self.deadlines.get(ride_number) == deadline:
+                del self.deadlines[ride_number]
+                if self.cancel_ride(ride_number) is not None:
+                    expired += 1
+        if expired:
+            self.expired_rides += expired
+            self.expiry_batches += 1
+
+
+# Build a dispatcher from the command-line choices: the heap backend by name, an aggregate tree for O(log n) Stats
+# and, when print_cache is a positive byte budget, a cache of Print(low, high) results
+def make_dispatcher(indexed=False, heap="binary", aggregates=False, print_cache=0):
+    dispatcher = RideDispatcher(indexed, HEAP_BACKENDS[heap](), AggregateRedBlackTree(indexed) if aggregates else None)
+    if print_cache:
+        dispatcher.range_cache = RangeCache(print_cache)
+    return dispatcher
+
+
+# Fixed-width binary record of one mutation in the write-ahead log: an opcode and up to three integer arguments
+RECORD = struct.Struct("<B3q")
+OP_INSERT = 1  # rideNumber, rideCost, tripDuration
+OP_UPDATE = 2  # rideNumber, new tripDuration (only the in-place decrease, the other branches log cancel/insert)
+OP_CANCEL = 3  # rideNumber
+OP_EXPIRY = 4  # rideNumber, deadline on the logical clock
+OP_CLOCK = 5  # logical clock, logged on every tick once a ride has a TTL
+
+WAL_HEADER = struct.Struct("<8sq")
+WAL_MAGIC = b"GTXWAL1\0"
+SNAPSHOT_HEADER = struct.Struct("<8sqqq")
+SNAPSHOT_MAGIC = b"GTXSNAP2"
+# snapshots written before TTLs were persisted: no clock in the header and no deadline column
+SNAPSHOT_V1_HEADER = struct.Struct("<8sqq")
+SNAPSHOT_V1_MAGIC = b"GTXSNAP1"
+
+
+# Append-only log of the mutations applied to a RideDispatcher since the last snapshot. The header carries a
+# generation number that ties the log to the snapshot it continues from
+class WriteAheadLog:
+    def __init__(self, path, generation, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.generation = generation
+        self.records = 0
+        self.dirty = False
+        if os.path.exists(path) and read_wal_generation(path) == generation:
+            # continue the log of the current generation, dropping a torn record a crash may have left at the end
+            self.file = open(path, "ab")
+            self.file.truncate(os.path.getsize(path) - (os.path.getsize(path) - WAL_HEADER.size) % RECORD.size)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(WAL_HEADER.pack(WAL_MAGIC, generation))
+            self.dirty = True
+
+    def append(self, opcode, first=0, second=0, third=0):
+        self.file.write(RECORD.pack(opcode, first, second, third))
+        self.records += 1
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.dirty = False
+
+    # Start an empty log for a new generation, once a snapshot holds everything logged so far
+    def reset(self, generation):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(WAL_HEADER.pack(WAL_MAGIC, generation))
+        self.generation = generation
+        self.records = 0
+        self.dirty = True
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_wal_generation(path):
+    with open(path, "rb") as wal_file:
+        header = wal_file.read(WAL_HEADER.size)
+    if len(header) < WAL_HEADER.size or header[:8] != WAL_MAGIC:
+        return None
+    return WAL_HEADER.unpack(header)[1]
+
+
+# Yield the (opcode, first, second, third) records of a log, ignoring a torn record at the end left by a crash
+def read_wal_records(path):
+    with open(path, "rb") as wal_file:
+        wal_file.seek(WAL_HEADER.size)
+        data = wal_file.read()
+    usable = len(data) - len(data) % RECORD.size
+    return RECORD.iter_unpack(memoryview(data)[:usable])
+
+
+# Write every pending ride to a compact binary snapshot: a header with the generation, ride count and logical clock,
+# followed by (rideNumber, rideCost, tripDuration, deadline) quadruples in rideNumber order, deadline 0 for a ride
+# without a TTL. The file is written next to its destination and renamed over it, so a crash never leaves a
+# half-written snapshot behind
+def write_snapshot(dispatcher, path, generation):
+    columns = array("q")
+    deadlines = dispatcher.deadlines
+    for ride in dispatcher.iter_rides_in_range(-sys.maxsize, sys.maxsize):
+        columns.append(ride.rideNumber)
+        columns.append(ride.rideCost)
+        columns.append(ride.tripDuration)
+        columns.append(deadlines.get(ride.rideNumber, 0))
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation, len(columns) // 4, dispatcher.clock))
+        columns.tofile(snapshot_file)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+
+# Load a snapshot into an empty dispatcher with bulk_load_rides, restore the logical clock and the TTLs, and return
+# its generation
+def load_snapshot(dispatcher, path):
+    with open(path, "rb") as snapshot_file:
+        magic = snapshot_file.read(len(SNAPSHOT_MAGIC))
+        snapshot_file.seek(0)
+        if magic == SNAPSHOT_MAGIC:
+            magic, generation, count, clock = SNAPSHOT_HEADER.unpack(snapshot_file.read(SNAPSHOT_HEADER.size))
+            width = 4
+        elif magic == SNAPSHOT_V1_MAGIC:
+            magic, generation, count = SNAPSHOT_V1_HEADER.unpack(snapshot_file.read(SNAPSHOT_V1_HEADER.size))
+            clock = 0
+            width = 3
+        else:
+            raise ValueError("not a gatorTaxi snapshot: " + path)
+        columns = array("q")
+        columns.fromfile(snapshot_file, count * width)
+    rows = range(0, len(columns), width)
+    dispatcher.bulk_load_rides([Ride(columns[i], columns[i + 1], columns[i + 2]) for i in rows])
+    dispatcher.clock = clock
+    if width == 4:
+        for i in rows:
+            if columns[i + 3]:
+                dispatcher.expire_at(columns[i], columns[i + 3])
+    return generation
+
+
+# Crash-safe persistence for a RideDispatcher: every mutation goes to a write-ahead log, and every `snapshot_every`
+# logged mutations the whole state is written to a snapshot and the log starts over. Recovery bulk-loads the
+# latest snapshot and replays only the log written after it, so the dispatcher passed in must be empty
+class RidePersistence:
+    def __init__(self, dispatcher, snapshot_path, wal_path, snapshot_every=100000, fsync=False):
+        self.dispatcher = dispatcher
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.generation = 0
+        self.recover(wal_path)
+        self.wal = WriteAheadLog(wal_path, self.generation, fsync)
+        dispatcher.wal = self.wal
+
+    def recover(self, wal_path):
+        if os.path.exists(self.snapshot_path):
+            self.generation = load_snapshot(self.dispatcher, self.snapshot_path)
+        # a log from an older generation is already contained in the snapshot
+        if os.path.exists(wal_path) and read_wal_generation(wal_path) == self.generation:
+            replay = {
+                OP_INSERT: lambda first, second, third: self.dispatcher.insert_ride(Ride(first, second, third)),
+                OP_UPDATE: lambda first, second, third: self.dispatcher.update_ride(first, second),
+                OP_CANCEL: lambda first, second, third: self.dispatcher.cancel_ride(first),
+                OP_EXPIRY: lambda first, second, third: self.dispatcher.expire_at(first, second),
+                # the rides that expired on a tick were logged as cancelled, so the clock is only set
+                OP_CLOCK: lambda first, second, third: setattr(self.dispatcher, "clock", first),
+            }
+            for opcode, first, second, third in read_wal_records(wal_path):
+                replay[opcode](first, second, third)
+
+    # Write a snapshot of the current state and start a new, empty log generation
+    def checkpoint(self):
+        self.wal.flush()
+        write_snapshot(self.dispatcher, self.snapshot_path, self.generation + 1)
+        self.generation += 1
+        self.wal.reset(self.generation)
+
+    # Called between commands: makes the logged mutations durable and snapshots once the log has grown enough
+    def after_command(self):
+        if self.snapshot_every is not None and self.wal.records >= self.snapshot_every:
+            self.checkpoint()
+        else:
+            self.wal.flush()
 
+    def close(self):
+        self.wal.close()
+        self.dispatcher.wal = None
 
-# Function to cancel a ride request from the system
-def cancel_ride(ride_number, heap, rbt):
-    # Delete the ride request from the Red-Black Tree and get its corresponding Min Heap node
-    heap_node = rbt.delete_node(ride_number)
-    if heap_node is not None:
-        # Delete the corresponding Min Heap node
-        heap.delete_element(heap_node.min_heap_index)
-
-
-# Function to update the duration of a ride request in the system
-def update_ride(rideNumber, new_duration, heap, rbt):
-    # Get the Red-Black Tree node corresponding to the ride request
-    rbt_node = rbt.get_ride(rideNumber)
-    if rbt_node is None:
-        # If ride request doesn't exist, print a message indicating the same
-        print("")
-    elif new_duration <= rbt_node.ride.tripDuration:
-        # If the new duration is less than or equal to the current duration, update the Min Heap node accordingly
-        heap.update_element(rbt_node.min_heap_node.min_heap_index, new_duration)
-    elif rbt_node.ride.tripDuration < new_duration <= (2 * rbt_node.ride.tripDuration):
-        # If the new duration is between the current duration and twice the current duration, cancel the ride request
-        # and insert a new ride request with the updated duration and cost
-        cancel_ride(rbt_node.ride.rideNumber, heap, rbt)
-        insert_ride(Ride(rbt_node.ride.rideNumber, rbt_node.ride.rideCost + 10, new_duration), heap, rbt)
-    else:
-        # If the new duration is more than twice the current duration, cancel the ride request
-        cancel_ride(rbt_node.ride.rideNumber, heap, rbt)
 
+# Format a ride the way it appears in the output file, e.g. "(5,50,120)"
+def format_ride(ride):
+    return "(" + str(ride.rideNumber) + "," + str(ride.rideCost) + "," + str(ride.tripDuration) + ")"
 
-def print_ride(rideNumber, rbt):
-    # get the ride from the red-black tree using the given ride number
-    result = rbt.get_ride(rideNumber)
-    # if the result is None, i.e. no ride was found with the given ride number
-    if result is None:
-        # add a placeholder ride with all values set to 0 to the output
-        output_helper(Ride(0, 0, 0), "", False)
-    else:
-        # add the found ride to the output
-        output_helper(result.ride, "", False)
 
+# The line write_rides writes for a sequence of rides, as a string
+def format_rides(rides):
+    line = ",".join([format_ride(ride) for ride in rides])
+    return (line or "(0,0,0)") + "\n"
 
-def print_rides(low, high, rbt):
-    # get a list of rides from the red-black tree within the given range [low, high]
-    list = rbt.get_rides_in_range(low, high)
-    # add the list of rides to the output as a single string, with each ride separated by a newline character
-    output_helper(list, "", True)
+
+# Write a lazily produced sequence of rides as one comma separated line, or (0,0,0) if there are none
+def write_rides(rides, output):
+    first = next(rides, None)
+    if first is None:
+        output.write("(0,0,0)\n")
+        return
+    output.write(format_ride(first))
+    for ride in rides:
+        output.write("," + format_ride(ride))
+    output.write("\n")
 
 
-def output_helper(ride, message, list):
-    file = open("output_file.txt", "a")
+def output_helper(output, ride, message, list):
     if ride is None:
-        file.write(message + "\n")
+        output.write(message + "\n")
+    elif not list:
+        output.write(format_ride(ride) + "\n")
+    elif len(ride) == 0:
+        output.write("(0,0,0)\n")
     else:
-        message = ""
-        if not list:
-            message += ("(" + str(ride.rideNumber) + "," + str(ride.rideCost) + "," + str(ride.tripDuration) + ")\n")
+        # build the whole range line with a single join instead of growing a string ride by ride
+        output.write(",".join([format_ride(r) for r in ride]) + "\n")
+
+
+# Least recently used cache of formatted Print(low, high) lines, keyed by (low, high) and bounded by the total length
+# of the lines it holds. The dispatcher reports every rideNumber it inserts, removes or changes, and the cached
+# ranges containing it are dropped. That check looks at every cached range, so the cache is meant for a modest number
+# of hot ranges; a range whose line is larger than the whole budget is not cached
+class RangeCache:
+    def __init__(self, max_bytes, max_entries=256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, low, high):
+        line = self.entries.get((low, high))
+        if line is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((low, high))
+        self.hits += 1
+        return line
+
+    def put(self, low, high, line):
+        if len(line) > self.max_bytes:
+            return
+        self.entries[(low, high)] = line
+        self.bytes += len(line)
+        while self.bytes > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    # Drop the cached ranges containing the rideNumber
+    def invalidate(self, ride_number):
+        if self.entries:
+            self.__drop([key for key in self.entries if key[0] <= ride_number <= key[1]])
+
+    # Drop the cached ranges overlapping [low, high]
+    def invalidate_range(self, low, high):
+        if self.entries:
+            self.__drop([key for key in self.entries if key[0] <= high and low <= key[1]])
+
+    def __drop(self, keys):
+        for key in keys:
+            self.bytes -= len(self.entries.pop(key))
+        self.invalidations += len(keys)
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.bytes = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Buffers output lines in memory and writes them to the output file in batches. The buffer is flushed once it
+# holds max_buffered_bytes characters or max_buffered_lines lines (either limit may be None to disable it), and
+# always when the writer is closed at the end of the run
+class OutputWriter:
+    def __init__(self, path="output_file.txt", max_buffered_bytes=65536, max_buffered_lines=None):
+        # "-" writes to stdout, anything else is truncated and opened once for the whole run
+        if path == "-":
+            self.file = sys.stdout
         else:
-            if len(ride) == 0:
-                message += "(0,0,0)\n"
-            for i in range(len(ride)):
-                if i != len(ride) - 1:
-                    message = message + ("(" + str(ride[i].rideNumber) + "," + str(ride[i].rideCost) + "," + str(
-                        ride[i].tripDuration) + "),")
-                else:
-                    message = message + ("(" + str(ride[i].rideNumber) + "," + str(ride[i].rideCost) + "," + str(
-                        ride[i].tripDuration) + ")\n")
+            self.file = open(path, "w")
+        self.max_buffered_bytes = max_buffered_bytes
+        self.max_buffered_lines = max_buffered_lines
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.buffered_lines = 0
+
+    def write(self, text):
+        # text may be a whole line or a piece of one, only completed lines count towards max_buffered_lines
+        self.buffer.append(text)
+        self.buffered_bytes += len(text)
+        if text[-1:] == "\n":
+            self.buffered_lines += 1
+        if (self.max_buffered_bytes is not None and self.buffered_bytes >= self.max_buffered_bytes) or \
+                (self.max_buffered_lines is not None and self.buffered_lines >= self.max_buffered_lines):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.buffer = []
+            self.buffered_bytes = 0
+            self.buffered_lines = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+# Split a command line such as "Insert(5,50,120)" into its name and integer arguments in a single pass
+def parse_command(line):
+    open_index = line.find("(")
+    if open_index == -1:
+        # blank or malformed line, there is no command to run
+        return None
+    close_index = line.find(")", open_index)
+    if close_index == -1:
+        close_index = len(line)
+    arguments = [int(i) for i in line[open_index + 1:close_index].split(",") if i.strip() != ""]
+    return line[:open_index].strip(), arguments
 
-        file.write(message)
-    file.close()
+
+# Lazily yield (command name, arguments) pairs from a text stream, one line at a time, so the whole command log
+# never has to be held in memory
+def read_commands(stream):
+    for line in stream:
+        command = parse_command(line)
+        if command is not None:
+            yield command
+
+
+def insert_command(ride_details, dispatcher, output):
+    # an optional fourth argument is the ride's TTL in commands
+    dispatcher.insert_ride(Ride(ride_details[0], ride_details[1], ride_details[2]),
+                           ride_details[3] if len(ride_details) > 3 else None)
+
+
+def update_command(ride_details, dispatcher, output):
+    # updating a ride that is not pending produces no output
+    dispatcher.update_ride(ride_details[0], ride_details[1])
+
+
+def get_next_command(ride_details, dispatcher, output):
+    ride = dispatcher.get_next_ride()
+    if ride is None:
+        output_helper(output, None, "No active ride requests", False)
+    else:
+        output_helper(output, ride, "", False)
+
+
+def peek_command(ride_details, dispatcher, output):
+    rides = dispatcher.peek_rides(1)
+    if not rides:
+        output_helper(output, None, "No active ride requests", False)
+    else:
+        output_helper(output, rides[0], "", False)
+
+
+def peek_next_command(ride_details, dispatcher, output):
+    if ride_details[0] <= 0:
+        # no rides were asked for, which says nothing about whether any are pending
+        output_helper(output, [], "", True)
+        return
+    rides = dispatcher.peek_rides(ride_details[0])
+    if not rides:
+        output_helper(output, None, "No active ride requests", False)
+    else:
+        output_helper(output, rides, "", True)
+
+
+def cancel_command(ride_details, dispatcher, output):
+    dispatcher.cancel_ride(ride_details[0])
+
+
+def count_command(ride_details, dispatcher, output):
+    output.write(str(dispatcher.count_rides(ride_details[0], ride_details[1])) + "\n")
+
+
+def rank_command(ride_details, dispatcher, output):
+    output.write(str(dispatcher.rank_ride(ride_details[0])) + "\n")
+
+
+def select_command(ride_details, dispatcher, output):
+    ride = dispatcher.select_ride(ride_details[0])
+    output_helper(output, Ride(0, 0, 0) if ride is None else ride, "", False)
+
+
+def stats_command(ride_details, dispatcher, output):
+    output.write("(" + ",".join([str(value) for value in dispatcher.range_stats(ride_details[0], ride_details[1])])
+                 + ")\n")
+
+
+# Lines written at a time for the rides GetNextRides(k) asked for beyond the pending ones
+MISSING_RIDE_LINES_PER_WRITE = 4096
+
+
+def get_next_rides_command(ride_details, dispatcher, output):
+    rides = dispatcher.get_next_rides(ride_details[0])
+    # one write for the whole batch, one line per ride as repeated GetNextRide commands would print them
+    output.write("".join([format_ride(ride) + "\n" for ride in rides]))
+    # and, like them, "No active ride requests" once for every ride that was missing, written in bounded chunks so
+    # that a huge k is paced by the output's flushing instead of building one huge string
+    missing = ride_details[0] - len(rides)
+    while missing > 0:
+        lines = min(missing, MISSING_RIDE_LINES_PER_WRITE)
+        output.write("No active ride requests\n" * lines)
+        missing -= lines
+
+
+def cancel_range_command(ride_details, dispatcher, output):
+    dispatcher.cancel_range(ride_details[0], ride_details[1])
+
+
+def print_command(ride_details, dispatcher, output):
+    if len(ride_details) == 1:  # Print one Specific Ride, or a placeholder ride with all values set to 0
+        ride = dispatcher.get_ride(ride_details[0])
+        output_helper(output, Ride(0, 0, 0) if ride is None else ride, "", False)
+    elif len(ride_details) == 2:  # Print Range of Rides, from the range cache when there is one
+        cache = dispatcher.range_cache
+        if cache is None:
+            write_rides(dispatcher.iter_rides_in_range(ride_details[0], ride_details[1]), output)
+            return
+        line = cache.get(ride_details[0], ride_details[1])
+        if line is None:
+            line = format_rides(dispatcher.iter_rides_in_range(ride_details[0], ride_details[1]))
+            cache.put(ride_details[0], ride_details[1], line)
+        output.write(line)
+    elif 3 <= len(ride_details) <= 4:  # Print one page of a Range of Rides: Print(low,high,limit[,offset])
+        if min(ride_details[2:]) < 0:
+            # a negative limit or offset selects no rides, on every kind of dispatcher
+            output.write("(0,0,0)\n")
+            return
+        write_rides(dispatcher.iter_rides_in_range(ride_details[0], ride_details[1], *ride_details[2:]), output)
+
+
+# Maps each command name of the input grammar to the function that runs it
+COMMANDS = {
+    "Insert": insert_command,
+    "UpdateTrip": update_command,
+    "GetNextRide": get_next_command,
+    "CancelRide": cancel_command,
+    "Print": print_command,
+    "Peek": peek_command,
+    "PeekNext": peek_next_command,
+    "GetNextRides": get_next_rides_command,
+    "CancelRange": cancel_range_command,
+    "Count": count_command,
+    "Rank": rank_command,
+    "Select": select_command,
+    "Stats": stats_command,
+}
+
+
+# The smallest and largest number of arguments each command takes, for callers that must reject malformed commands
+# up front, like the service; a batch replay stays as lenient as it always was
+COMMAND_ARGUMENT_COUNTS = {
+    "Insert": (3, 4),
+    "UpdateTrip": (2, 2),
+    "GetNextRide": (0, 0),
+    "CancelRide": (1, 1),
+    "Print": (1, 4),
+    "Peek": (0, 0),
+    "PeekNext": (1, 1),
+    "GetNextRides": (1, 1),
+    "CancelRange": (2, 2),
+    "Count": (2, 2),
+    "Rank": (1, 1),
+    "Select": (1, 1),
+    "Stats": (2, 2),
+}
+
+
+# Whether a parsed command names a known command and has a number of arguments it takes
+def is_valid_command(name, ride_details):
+    counts = COMMAND_ARGUMENT_COUNTS.get(name)
+    return counts is not None and counts[0] <= len(ride_details) <= counts[1]
+
+
+# Run a single command against the dispatcher, writing its results to output. Every command, even an unknown one,
+# is a tick of the dispatcher's logical clock, and the rides whose TTL has run out are expired before it runs
+def run_command(name, ride_details, dispatcher, output):
+    dispatcher.tick()
+    command = COMMANDS.get(name)
+    if command is not None:
+        command(ride_details, dispatcher, output)
+
+
+# Run every command from the stream against the dispatcher, writing results to output. A duplicate rideNumber is
+# reported and ends the run
+def run_commands(commands, dispatcher, output):
+    try:
+        for name, ride_details in commands:
+            run_command(name, ride_details, dispatcher, output)
+        # a sharded dispatcher may still hold queued inserts that turn out to be duplicates
+        dispatcher.sync()
+    except DuplicateRideError as error:
+        output_helper(output, None, str(error), False)
+
+
+# Binary command files: a header followed by one fixed-width record per command, holding the command's code, its
+# argument count and up to four integer arguments. Replaying one skips all text parsing
+COMMAND_RECORD = struct.Struct("<BB6x4q")
+COMMAND_FILE_MAGIC = b"GTXCMDS1"
+
+# Command names by binary code; new commands are only ever appended, so existing files keep their meaning
+COMMAND_NAMES = ["", "Insert", "UpdateTrip", "GetNextRide", "CancelRide", "Print", "Peek", "PeekNext", "GetNextRides",
+                 "CancelRange", "Count", "Rank", "Select", "Stats"]
+COMMAND_CODES = {name: code for code, name in enumerate(COMMAND_NAMES) if name}
+
+
+# Convert a text command file into the binary format
+def convert_text_to_binary(text_path, binary_path):
+    with open(text_path, "r") as text_file, open(binary_path, "wb") as binary_file:
+        binary_file.write(COMMAND_FILE_MAGIC)
+        for name, ride_details in read_commands(text_file):
+            if name not in COMMAND_CODES or len(ride_details) > 4:
+                raise ValueError("cannot encode command %s%s" % (name, tuple(ride_details)))
+            binary_file.write(COMMAND_RECORD.pack(COMMAND_CODES[name], len(ride_details),
+                                                  *(ride_details + [0] * (4 - len(ride_details)))))
+
+
+# Lazily yield (command name, arguments) pairs from a binary command file. The file is memory-mapped and the records
+# are decoded straight out of the mapping with struct.iter_unpack, without reading or copying it first
+def read_binary_commands(path):
+    with open(path, "rb") as binary_file:
+        if os.path.getsize(path) <= len(COMMAND_FILE_MAGIC):
+            return
+        with mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            if mapping[:len(COMMAND_FILE_MAGIC)] != COMMAND_FILE_MAGIC:
+                raise ValueError("not a gatorTaxi command file: " + path)
+            records = memoryview(mapping)[len(COMMAND_FILE_MAGIC):]
+            try:
+                for code, count, first, second, third, fourth in COMMAND_RECORD.iter_unpack(records):
+                    yield COMMAND_NAMES[code], [first, second, third, fourth][:count]
+            finally:
+                # the mapping cannot be closed while a view of it is alive
+                records.release()
+
+
+# Parse the command line arguments
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Replay gatorTaxi ride commands")
+    parser.add_argument("input", help="input file with one command per line, or - to read from stdin")
+    parser.add_argument("-o", "--output", default="output_file.txt", help="output file, or - for stdout")
+    parser.add_argument("--flush-bytes", type=int, default=65536,
+                        help="flush the output once this many characters are buffered (0 disables the limit)")
+    parser.add_argument("--flush-lines", type=int, default=0,
+                        help="flush the output once this many lines are buffered (0 disables the limit)")
+    parser.add_argument("--index", action="store_true",
+                        help="keep a hash index of rideNumbers for O(1) Print(n), UpdateTrip and CancelRide lookups")
+    add_heap_argument(parser)
+    add_aggregates_argument(parser)
+    add_print_cache_argument(parser)
+    parser.add_argument("--binary", action="store_true", help="the input is a binary command file (see --convert)")
+    parser.add_argument("--convert", metavar="BINARY_FILE",
+                        help="only convert the text input into a binary command file, without running it")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="partition the rides by rideNumber range across this many worker processes")
+    parser.add_argument("--shard-key-space", type=int, default=2 ** 31,
+                        help="rideNumbers are expected in [0, this), each shard owns an equal slice of it")
+    parser.add_argument("--profile", nargs="?", const="summary", choices=["summary", "cprofile"],
+                        help="report per-command latencies and heap/tree counters (or cProfile output) on stderr")
+    parser.add_argument("--check-every", type=int, default=0, metavar="N",
+                        help="debug mode: check the heap and tree invariants after every N commands and at the end")
+    add_persistence_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_heap_argument(parser):
+    parser.add_argument("--heap", choices=sorted(HEAP_BACKENDS), default="binary",
+                        help="priority queue backend ordering the rides by cost and duration")
+
+
+def add_print_cache_argument(parser):
+    parser.add_argument("--print-cache", type=int, default=0, metavar="BYTES",
+                        help="cache the output of Print(low,high) in an LRU cache holding up to this many characters")
+
+
+def add_aggregates_argument(parser):
+    parser.add_argument("--aggregates", action="store_true",
+                        help="keep cost and duration aggregates in the tree so Stats(low,high) takes O(log n)")
+
+
+def add_persistence_arguments(parser):
+    parser.add_argument("--snapshot", help="snapshot file to recover from and checkpoint to (needs --wal)")
+    parser.add_argument("--wal", help="write-ahead log of mutations since the last snapshot (needs --snapshot)")
+    parser.add_argument("--snapshot-every", type=int, default=100000,
+                        help="checkpoint once the log holds this many mutations (0 only checkpoints at exit)")
+    parser.add_argument("--wal-fsync", action="store_true", help="fsync the log after every mutating command")
+
+
+# Recover the dispatcher from --snapshot/--wal and start logging to them, or return None if persistence is off
+def open_persistence(args, dispatcher):
+    if args.snapshot is None and args.wal is None:
+        return None
+    if args.snapshot is None or args.wal is None:
+        raise SystemExit("--snapshot and --wal must be given together")
+    return RidePersistence(dispatcher, args.snapshot, args.wal, args.snapshot_every or None, args.wal_fsync)
+
+
+# Pass the commands through, letting the persistence layer flush and checkpoint between two commands
+def persisted_commands(commands, persistence):
+    for command in commands:
+        yield command
+        persistence.after_command()
+
+
+# Run a stream of commands, through the persistence layer, the invariant checks and the profiler when they are enabled
+def replay(commands, dispatcher, output, persistence, profile=None, check_every=0):
+    if persistence is not None:
+        commands = persisted_commands(commands, persistence)
+    if check_every:
+        from gatorTaxiCheck import checked_commands
+        commands = checked_commands(commands, dispatcher, check_every)
+    if profile is not None:
+        profile.run(commands, dispatcher, output)
+    else:
+        run_commands(commands, dispatcher, output)
 
 
 # The main function
-def main():
-    # Check if the number of arguments provided is valid
-    if len(sys.argv) < 2:
-        print("Invalid Arguments")
-        print("Enter Command of the form : python3 gator_taxi.py <input_file_name.txt>")
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.convert is not None:
+        convert_text_to_binary(args.input, args.convert)
         return
 
-    # Create a heap and a red-black tree to store the rides
-    ride_heap = Min_Heap()
-    ride_tree = Red_Black_Tree()
-
-    # Open the input and output files
-    with open(sys.argv[1], "r") as input_file, open("output_file.txt", "w") as output_file:
-
-        # Read each line of the input file
-        for line in input_file.readlines():
-
-            # Extract the ride details from the line
-            ride_details = [int(i) for i in line[line.index("(") + 1:line.index(")")].split(",") if i != '']
-
-            # Depending on the command, either insert, update, get next, cancel, or print the ride/range of rides
-            if "Insert" in line:  # Insert a new ride
-                ride = Ride(ride_details[0], ride_details[1], ride_details[2])
-                insert_ride(ride, ride_heap, ride_tree)
-            elif "UpdateTrip" in line:  # Update trip
-                update_ride(ride_details[0], ride_details[1], ride_heap, ride_tree)
-            elif "GetNextRide" in line:  # Get the Next Ride
-                get_next_ride(ride_heap, ride_tree)
-            elif "CancelRide" in line:  # Cancel Ride
-                cancel_ride(ride_details[0], ride_heap, ride_tree)
-            elif "Print" in line:
-                if len(ride_details) == 1:  # Print one Specific Ride
-                    print_ride(ride_details[0], ride_tree)
-                elif len(ride_details) == 2:  # Print Range of Rides
-                    print_rides(ride_details[0], ride_details[1], ride_tree)
-
-    # Close the output file
-    output_file.close()
+    # gatorTaxiShards, gatorTaxiProfile and gatorTaxiCheck import this module by name, which must not load a second
+    # copy when it runs as a script
+    sys.modules.setdefault("gatorTaxi", sys.modules[__name__])
+    profile = None
+    if args.profile is not None:
+        from gatorTaxiProfile import Profile
+        profile = Profile(args.profile)
+
+    # The dispatcher owns the heap and the red-black tree that store the rides; with persistence enabled it starts
+    # from the recovered state
+    if args.shards:
+        if args.snapshot is not None or args.wal is not None:
+            raise SystemExit("--shards cannot be combined with --snapshot/--wal")
+        if args.check_every:
+            raise SystemExit("--shards cannot be combined with --check-every")
+        if args.print_cache:
+            raise SystemExit("--shards cannot be combined with --print-cache")
+        from gatorTaxiShards import ShardedDispatcher
+        dispatcher = ShardedDispatcher(args.shards, args.shard_key_space, args.index, args.heap, args.aggregates)
+    elif profile is not None:
+        dispatcher = profile.dispatcher(args.index, args.heap, args.aggregates, args.print_cache)
+    else:
+        dispatcher = make_dispatcher(args.index, args.heap, args.aggregates, args.print_cache)
+    persistence = open_persistence(args, dispatcher)
+
+    # A single buffered writer collects every result; it is flushed when the run ends, however it ends
+    output = OutputWriter(args.output, args.flush_bytes or None, args.flush_lines or None)
+    try:
+        # Stream the commands from a binary command file, the input file, or stdin when the file name is "-"
+        if args.binary:
+            replay(read_binary_commands(args.input), dispatcher, output, persistence, profile, args.check_every)
+        elif args.input == "-":
+            replay(read_commands(sys.stdin), dispatcher, output, persistence, profile, args.check_every)
+        else:
+            with open(args.input, "r") as input_file:
+                replay(read_commands(input_file), dispatcher, output, persistence, profile, args.check_every)
+        if persistence is not None:
+            persistence.checkpoint()
+    finally:
+        output.close()
+        if persistence is not None:
+            persistence.close()
+        if args.shards:
+            dispatcher.close()
 
 
 # Call the main function after the file is run
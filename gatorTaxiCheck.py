@@ -0,0 +1,380 @@
+import argparse
+import bisect
+import io
+import random
+import sys
+
+from gatorTaxi import (HEAP_BACKENDS, AggregateTreeNode, DAryHeap, DuplicateRideError, PairingHeap, Ride,
+                       format_ride, format_rides, make_dispatcher, run_command)
+
+
+# Raised when the heap and the tree of a dispatcher are no longer consistent
+class InvariantError(Exception):
+    pass
+
+
+def require(condition, message, *values):
+    if not condition:
+        raise InvariantError(message % values)
+
+
+# Check an array heap (Min_Heap or DAryHeap): every slot's back-pointer, every cached key and the heap order
+def check_array_heap(heap):
+    heap_list = heap.heap_list
+    require(len(heap_list) - 1 == heap.current_size, "heap holds %d nodes but current_size is %d",
+            len(heap_list) - 1, heap.current_size)
+    arity = heap.arity if isinstance(heap, DAryHeap) else 2
+    for index in range(1, len(heap_list)):
+        node = heap_list[index]
+        require(node.min_heap_index == index, "heap node in slot %d has min_heap_index %d", index, node.min_heap_index)
+        require(node.key == (node.ride.rideCost, node.ride.tripDuration), "stale key %s for ride %s", node.key,
+                format_ride(node.ride))
+        if index > 1:
+            parent = heap_list[(index - 2) // arity + 1]
+            require(parent.key <= node.key, "heap order broken between %s and its child %s", format_ride(parent.ride),
+                    format_ride(node.ride))
+    return heap_list[1:]
+
+
+# Check a pairing heap: the sibling and parent links, every cached key and the heap order
+def check_pairing_heap(heap):
+    nodes = []
+    root = heap.root
+    if root is not None:
+        require(root.prev is None and root.sibling is None, "pairing heap root has a parent or a sibling")
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            require(node.min_heap_index != 0, "pairing heap node %s is marked removed", format_ride(node.ride))
+            require(node.key == (node.ride.rideCost, node.ride.tripDuration), "stale key %s for ride %s", node.key,
+                    format_ride(node.ride))
+            previous = node
+            child = node.child
+            while child is not None:
+                require(child.prev is previous, "broken prev link at %s", format_ride(child.ride))
+                require(node.key <= child.key, "heap order broken between %s and its child %s",
+                        format_ride(node.ride), format_ride(child.ride))
+                stack.append(child)
+                previous = child
+                child = child.sibling
+    require(len(nodes) == heap.current_size, "pairing heap holds %d nodes but current_size is %d", len(nodes),
+            heap.current_size)
+    return nodes
+
+
+# Check the red-black tree: search order, parent links, red nodes with black children, equal black heights on every
+# path, subtree sizes and, for an aggregate tree, subtree aggregates; returns the tree nodes in order. The walk is
+# iterative, so a tree that is badly out of balance is reported instead of overflowing the stack
+def check_tree(rbt):
+    null_node = rbt.null_node
+    require(null_node.color == 0 and null_node.size == 0, "the null node is not black with size 0")
+    nodes = []
+    if rbt.root == null_node:
+        return nodes
+    require(rbt.root.parent is None and rbt.root.color == 0, "the root is red or has a parent")
+    aggregated = isinstance(rbt.root, AggregateTreeNode)
+    # post-order walk: (node, low bound, high bound, children done)
+    black_heights = {id(null_node): 1}
+    stack = [(rbt.root, None, None, False)]
+    while stack:
+        node, low, high, children_done = stack.pop()
+        ride_number = node.ride.rideNumber
+        if not children_done:
+            require(low is None or ride_number > low, "ride %d is out of order", ride_number)
+            require(high is None or ride_number < high, "ride %d is out of order", ride_number)
+            stack.append((node, low, high, True))
+            for child, child_low, child_high in ((node.left, low, ride_number), (node.right, ride_number, high)):
+                if child != null_node:
+                    require(child.parent is node, "ride %d has a wrong parent link", child.ride.rideNumber)
+                    require(node.color == 0 or child.color == 0, "red ride %d has a red child", ride_number)
+                    stack.append((child, child_low, child_high, False))
+            continue
+        left_height = black_heights.pop(id(node.left)) if node.left != null_node else 1
+        right_height = black_heights.pop(id(node.right)) if node.right != null_node else 1
+        require(left_height == right_height, "black heights differ below ride %d", ride_number)
+        black_heights[id(node)] = left_height + (node.color == 0)
+        require(node.size == node.left.size + node.right.size + 1, "wrong subtree size at ride %d", ride_number)
+        if aggregated:
+            ride = node.ride
+            require(node.sum_cost == node.left.sum_cost + node.right.sum_cost + ride.rideCost and
+                    node.min_cost == min(node.left.min_cost, node.right.min_cost, ride.rideCost) and
+                    node.max_cost == max(node.left.max_cost, node.right.max_cost, ride.rideCost) and
+                    node.sum_duration == node.left.sum_duration + node.right.sum_duration + ride.tripDuration and
+                    node.min_duration == min(node.left.min_duration, node.right.min_duration, ride.tripDuration) and
+                    node.max_duration == max(node.left.max_duration, node.right.max_duration, ride.tripDuration),
+                    "stale aggregates at ride %d", ride_number)
+        nodes.append(node)
+    nodes.sort(key=lambda node: node.ride.rideNumber)
+    return nodes
+
+
+# Check every invariant of a RideDispatcher: the heap, the tree, the links between them, the hash index, that both
+# structures hold the same rides, that no pending ride has outlived its TTL and that every cached Print result is
+# still current. Raises InvariantError on the first violation found
+def check_invariants(dispatcher):
+    heap = dispatcher.heap
+    heap_nodes = check_pairing_heap(heap) if isinstance(heap, PairingHeap) else check_array_heap(heap)
+    tree_nodes = check_tree(dispatcher.rbt)
+    require(len(heap_nodes) == len(tree_nodes), "the heap holds %d rides but the tree %d", len(heap_nodes),
+            len(tree_nodes))
+    for node in tree_nodes:
+        heap_node = node.min_heap_node
+        require(heap_node.rbTree is node, "ride %d is not linked back from its heap node", node.ride.rideNumber)
+        require(heap_node.ride is node.ride, "ride %d differs between the heap and the tree", node.ride.rideNumber)
+    # together with the equal counts this makes the heap nodes and the tree nodes a one-to-one match
+    for heap_node in heap_nodes:
+        require(heap_node.rbTree.min_heap_node is heap_node, "heap node of ride %d is not in the tree",
+                heap_node.ride.rideNumber)
+    index = dispatcher.rbt.index
+    if index is not None:
+        require(len(index) == len(tree_nodes), "the index holds %d rides but the tree %d", len(index), len(tree_nodes))
+        for node in tree_nodes:
+            require(index.get(node.ride.rideNumber) is node, "index entry of ride %d is wrong", node.ride.rideNumber)
+    if dispatcher.timers is not None:
+        require(len(dispatcher.deadlines) <= dispatcher.timers.count, "%d deadlines but %d timers",
+                len(dispatcher.deadlines), dispatcher.timers.count)
+        for ride_number, deadline in dispatcher.deadlines.items():
+            require(deadline > dispatcher.clock or dispatcher.get_ride(ride_number) is None,
+                    "ride %d is still pending after its deadline %d", ride_number, deadline)
+    cache = dispatcher.range_cache
+    if cache is not None:
+        require(cache.bytes == sum(len(line) for line in cache.entries.values()) <= cache.max_bytes,
+                "the print cache accounts for %d bytes", cache.bytes)
+        for (low, high), line in cache.entries.items():
+            require(line == format_rides(dispatcher.iter_rides_in_range(low, high)), "stale Print(%d,%d) in the cache",
+                    low, high)
+
+
+# Pass the commands through, checking the dispatcher's invariants after every `every` commands and once more at the
+# end. Each check is O(n), so a large `every` amortizes it over many cheap commands
+def checked_commands(commands, dispatcher, every):
+    count = 0
+    for name, ride_details in commands:
+        yield name, ride_details
+        count += 1
+        if count % every == 0:
+            check_after(dispatcher, count, name, ride_details)
+    check_after(dispatcher, count, "end of input", [])
+
+
+def check_after(dispatcher, count, name, ride_details):
+    try:
+        check_invariants(dispatcher)
+    except InvariantError as error:
+        raise InvariantError("after command %d, %s%s: %s" % (count, name, tuple(ride_details), error)) from None
+
+
+# A deliberately naive dispatcher to compare against: a dict of rides and a sorted list of their rideNumbers, with
+# every query answered by brute force, and a dict of the deadlines of rides with a TTL, scanned on every tick
+class NaiveDispatcher:
+    def __init__(self):
+        self.rides = {}
+        self.ride_numbers = []
+        self.clock = 0
+        self.deadlines = {}
+        self.range_cache = None
+
+    def insert_ride(self, ride, ttl=None):
+        if ride.rideNumber in self.rides:
+            raise DuplicateRideError(ride.rideNumber)
+        self.rides[ride.rideNumber] = Ride(ride.rideNumber, ride.rideCost, ride.tripDuration)
+        bisect.insort(self.ride_numbers, ride.rideNumber)
+        if ttl is not None:
+            self.deadlines[ride.rideNumber] = self.clock + ttl + 1
+
+    def cancel_ride(self, ride_number):
+        ride = self.rides.pop(ride_number, None)
+        if ride is not None:
+            del self.ride_numbers[bisect.bisect_left(self.ride_numbers, ride_number)]
+            self.deadlines.pop(ride_number, None)
+        return ride
+
+    def tick(self):
+        self.clock += 1
+        for ride_number in [number for number, deadline in self.deadlines.items() if deadline <= self.clock]:
+            self.cancel_ride(ride_number)
+
+    def update_ride(self, ride_number, new_duration):
+        ride = self.rides.get(ride_number)
+        if ride is None:
+            return False
+        if new_duration <= ride.tripDuration:
+            ride.tripDuration = new_duration
+        elif new_duration <= 2 * ride.tripDuration:
+            # the updated ride keeps its TTL
+            ride.rideCost += 10
+            ride.tripDuration = new_duration
+        else:
+            self.cancel_ride(ride_number)
+        return True
+
+    def get_ride(self, ride_number):
+        return self.rides.get(ride_number)
+
+    # The keys of the k cheapest rides; which of several equal-key rides goes first is up to the heap
+    def best_keys(self, k):
+        return sorted((ride.rideCost, ride.tripDuration) for ride in self.rides.values())[:k]
+
+    def iter_rides_in_range(self, low, high, limit=None, offset=0):
+        numbers = self.ride_numbers[bisect.bisect_left(self.ride_numbers, low):
+                                    bisect.bisect_right(self.ride_numbers, high)]
+        numbers = numbers[offset:] if limit is None else numbers[offset:offset + limit]
+        return iter([self.rides[number] for number in numbers])
+
+    def cancel_range(self, low, high):
+        rides = list(self.iter_rides_in_range(low, high))
+        for ride in rides:
+            self.cancel_ride(ride.rideNumber)
+        return rides
+
+    def count_rides(self, low, high):
+        return len(list(self.iter_rides_in_range(low, high)))
+
+    def rank_ride(self, ride_number):
+        return bisect.bisect_left(self.ride_numbers, ride_number) + 1 if ride_number in self.rides else 0
+
+    def select_ride(self, i):
+        return self.rides[self.ride_numbers[i - 1]] if 1 <= i <= len(self.ride_numbers) else None
+
+    def range_stats(self, low, high):
+        rides = list(self.iter_rides_in_range(low, high))
+        if not rides:
+            return 0, 0, 0, 0, 0, 0, 0
+        costs = [ride.rideCost for ride in rides]
+        durations = [ride.tripDuration for ride in rides]
+        return len(rides), sum(costs), min(costs), max(costs), sum(durations), min(durations), max(durations)
+
+    def __len__(self):
+        return len(self.rides)
+
+    def sync(self):
+        pass
+
+
+# Commands whose output depends on how the heap breaks ties between rides of equal cost and duration; for these
+# only the sequence of keys is compared, and the rides the real dispatcher removed are removed from the oracle
+TIE_DEPENDENT_COMMANDS = {"GetNextRide", "GetNextRides", "Peek", "PeekNext"}
+
+
+# Yield `count` random commands over a small rideNumber space, so that inserts, updates and cancels keep hitting the
+# same rides, and with few distinct costs and durations, so that ties are common
+def random_commands(rng, count, key_space=200, max_value=20):
+    for _ in range(count):
+        choice = rng.random()
+        ride_number = rng.randint(1, key_space)
+        if choice < 0.3:
+            yield "Insert", [ride_number, rng.randint(1, max_value), rng.randint(1, max_value)]
+        elif choice < 0.4:
+            yield "Insert", [ride_number, rng.randint(1, max_value), rng.randint(1, max_value),
+                             rng.choice([0, 1, 5, rng.randint(1, 500), rng.randint(1, 10000)])]
+        elif choice < 0.55:
+            yield "UpdateTrip", [ride_number, rng.randint(1, max_value * 3)]
+        elif choice < 0.62:
+            yield "CancelRide", [ride_number]
+        elif choice < 0.7:
+            yield "GetNextRide", []
+        elif choice < 0.74:
+            yield "Print", [ride_number]
+        elif choice < 0.76:
+            yield "Print", [ride_number, ride_number + rng.randint(-5, key_space // 2)]
+        elif choice < 0.78:
+            # a few hot ranges, printed again and again
+            yield "Print", rng.choice([[1, key_space], [key_space // 4, key_space // 2], [7, 9]])
+        elif choice < 0.8:
+            yield "Print", [ride_number, ride_number + key_space // 2, rng.randint(0, 5), rng.randint(0, 5)]
+        elif choice < 0.82:
+            yield "Peek", []
+        elif choice < 0.84:
+            yield "PeekNext", [rng.randint(0, 10)]
+        elif choice < 0.86:
+            yield "GetNextRides", [rng.choice([1, 3, 10, key_space])]
+        elif choice < 0.88:
+            yield "CancelRange", [ride_number, ride_number + rng.choice([2, 20, key_space])]
+        elif choice < 0.91:
+            yield "Count", [ride_number, ride_number + rng.randint(-5, key_space // 2)]
+        elif choice < 0.94:
+            yield "Rank", [ride_number]
+        elif choice < 0.97:
+            yield "Select", [rng.randint(0, key_space // 2)]
+        else:
+            yield "Stats", [ride_number, ride_number + rng.randint(-5, key_space // 2)]
+
+
+# Run a command, returning its output, with a duplicate rideNumber reported the way the service reports it
+def command_output(name, ride_details, dispatcher):
+    output = io.StringIO()
+    try:
+        run_command(name, ride_details, dispatcher, output)
+    except DuplicateRideError as error:
+        output.write(str(error) + "\n")
+    return output.getvalue()
+
+
+# The rides listed in a command's output; the (0,0,0) placeholder of an empty list is not a ride
+def parse_rides(text):
+    rides = []
+    for line in text.splitlines():
+        for part in line.split("),("):
+            numbers = part.strip("()").split(",")
+            if len(numbers) == 3 and numbers != ["0", "0", "0"]:
+                rides.append(tuple(int(number) for number in numbers))
+    return rides
+
+
+# Replay one random command stream against `dispatcher` and the naive oracle, checking the invariants after every
+# command. Raises InvariantError with the failing command on the first difference
+def differential_run(dispatcher, seed, count):
+    oracle = NaiveDispatcher()
+    rng = random.Random(seed)
+    for position, (name, ride_details) in enumerate(random_commands(rng, count), 1):
+        output = command_output(name, ride_details, dispatcher)
+        where = "seed %d, command %d, %s%s" % (seed, position, name, tuple(ride_details))
+        if name in TIE_DEPENDENT_COMMANDS:
+            # the oracle does not run these, but its clock must move on all the same
+            oracle.tick()
+            rides = parse_rides(output)
+            k = 1 if name in ("GetNextRide", "Peek") else ride_details[0]
+            require([(cost, duration) for _, cost, duration in rides] == oracle.best_keys(k),
+                    "%s: got %s, the cheapest rides are %s", where, rides, oracle.best_keys(k))
+            for ride_number, cost, duration in rides:
+                ride = oracle.get_ride(ride_number)
+                require(ride is not None and (ride.rideCost, ride.tripDuration) == (cost, duration),
+                        "%s: ride %d is not pending with that cost and duration", where, ride_number)
+                if name.startswith("GetNext"):
+                    oracle.cancel_ride(ride_number)
+        else:
+            expected = command_output(name, ride_details, oracle)
+            require(output == expected, "%s: got %r, expected %r", where, output, expected)
+        try:
+            check_invariants(dispatcher)
+        except InvariantError as error:
+            raise InvariantError("%s: %s" % (where, error)) from None
+    require(len(dispatcher) == len(oracle), "seed %d: %d rides pending, expected %d", seed, len(dispatcher),
+            len(oracle))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Differential fuzzer: random command streams are replayed against a "
+                                                 "RideDispatcher and a naive oracle, with invariant checks")
+    parser.add_argument("--seeds", type=int, default=100, help="number of command streams")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--commands", type=int, default=2000, help="commands per stream")
+    parser.add_argument("--heap", choices=sorted(HEAP_BACKENDS), default="binary")
+    parser.add_argument("--index", action="store_true")
+    parser.add_argument("--aggregates", action="store_true")
+    parser.add_argument("--print-cache", type=int, default=0, metavar="BYTES")
+    args = parser.parse_args()
+
+    for seed in range(args.first_seed, args.first_seed + args.seeds):
+        dispatcher = make_dispatcher(args.index, args.heap, args.aggregates, args.print_cache)
+        try:
+            differential_run(dispatcher, seed, args.commands)
+        except InvariantError as error:
+            print("FAILED " + str(error))
+            sys.exit(1)
+    print("%d command streams of %d commands passed" % (args.seeds, args.commands))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import cProfile
+import pstats
+import sys
+import time
+
+from gatorTaxi import Min_Heap, Red_Black_Tree, RideDispatcher, make_dispatcher, run_commands
+
+
+# Structure counters collected by the counting heap and tree below
+class Counters:
+    def __init__(self):
+        self.rotations = 0
+        self.sift_up_calls = 0
+        self.sift_up_steps = 0
+        self.sift_down_calls = 0
+        self.sift_down_steps = 0
+        self.max_sift_down_steps = 0
+        self.max_heap_size = 0
+
+
+# A Min_Heap that counts its sifts. The sifts move a node along one root-to-leaf path, so the number of levels it
+# moved is the difference in depth between its start and end slots; the sift loops themselves are left untouched
+class CountingMinHeap(Min_Heap):
+    def __init__(self, counters):
+        super().__init__()
+        self.counters = counters
+
+    def insert(self, element):
+        super().insert(element)
+        if self.current_size > self.counters.max_heap_size:
+            self.counters.max_heap_size = self.current_size
+
+    def heapify(self, heap_nodes):
+        super().heapify(heap_nodes)
+        if self.current_size > self.counters.max_heap_size:
+            self.counters.max_heap_size = self.current_size
+
+    def fix_heap_bottom_up(self, heap_element_index):
+        node = self.heap_list[heap_element_index]
+        super().fix_heap_bottom_up(heap_element_index)
+        self.counters.sift_up_calls += 1
+        self.counters.sift_up_steps += heap_element_index.bit_length() - node.min_heap_index.bit_length()
+
+    def fix_heap_top_down(self, heap_element_index):
+        if heap_element_index > self.current_size:
+            return
+        node = self.heap_list[heap_element_index]
+        super().fix_heap_top_down(heap_element_index)
+        steps = node.min_heap_index.bit_length() - heap_element_index.bit_length()
+        self.counters.sift_down_calls += 1
+        self.counters.sift_down_steps += steps
+        if steps > self.counters.max_sift_down_steps:
+            self.counters.max_sift_down_steps = steps
+
+
+# A Red_Black_Tree that counts the rotations insert_balance and delete_balance perform
+class CountingRedBlackTree(Red_Black_Tree):
+    def __init__(self, counters, indexed=False):
+        super().__init__(indexed)
+        self.counters = counters
+
+    def left_rotation(self, x):
+        self.counters.rotations += 1
+        super().left_rotation(x)
+
+    def right_rotation(self, x):
+        self.counters.rotations += 1
+        super().right_rotation(x)
+
+
+# Height of a red-black tree, found with an iterative walk since a degenerate tree would be too deep to recurse into
+def tree_height(rbt):
+    height = 0
+    stack = [(rbt.root, 1)] if rbt.root != rbt.null_node else []
+    while stack:
+        node, depth = stack.pop()
+        if depth > height:
+            height = depth
+        if node.left != rbt.null_node:
+            stack.append((node.left, depth + 1))
+        if node.right != rbt.null_node:
+            stack.append((node.right, depth + 1))
+    return height
+
+
+# Latencies of one kind of command, counted in power-of-two buckets of microseconds: bucket b holds the latencies
+# below 2 ** b us, so percentiles are reported as the upper bound of the bucket they fall in
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * 40
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[int(seconds * 1e6).bit_length()] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return 2 ** bucket
+        return 2 ** (len(self.buckets) - 1)
+
+
+# Opt-in instrumentation for a CLI run. In "summary" mode the dispatcher is built from the counting heap and tree
+# and every command is timed; in "cprofile" mode the run executes under cProfile instead. Either way a report is
+# written to stderr at the end of the run. Without --profile none of this is loaded and the hot paths are unchanged
+class Profile:
+    def __init__(self, mode, stream=sys.stderr):
+        self.mode = mode
+        self.stream = stream
+        self.counters = Counters()
+        self.latencies = {}
+
+    # A dispatcher whose structures report to this profile's counters; heap counters are only kept for the binary
+    # heap backend and rotations are not counted in an aggregate tree
+    def dispatcher(self, indexed=False, heap="binary", aggregates=False, print_cache=0):
+        dispatcher = make_dispatcher(indexed, heap, aggregates, print_cache)
+        if self.mode == "summary":
+            # the structures are still empty, so they can be swapped for the counting ones
+            if heap == "binary":
+                dispatcher.heap = CountingMinHeap(self.counters)
+            if not aggregates:
+                dispatcher.rbt = CountingRedBlackTree(self.counters, indexed)
+        return dispatcher
+
+    # Pass the commands through, timing each one from the moment it is handed out until the next one is requested
+    def timed_commands(self, commands):
+        perf_counter = time.perf_counter
+        for name, ride_details in commands:
+            # point and range prints have very different costs, so they get separate histograms
+            key = "Print(range)" if name == "Print" and len(ride_details) > 1 else name
+            start = perf_counter()
+            yield name, ride_details
+            elapsed = perf_counter() - start
+            histogram = self.latencies.get(key)
+            if histogram is None:
+                histogram = self.latencies[key] = LatencyHistogram()
+            histogram.record(elapsed)
+
+    def run(self, commands, dispatcher, output):
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                run_commands(commands, dispatcher, output)
+            finally:
+                profiler.disable()
+            pstats.Stats(profiler, stream=self.stream).sort_stats("cumulative").print_stats(30)
+        else:
+            run_commands(self.timed_commands(commands), dispatcher, output)
+            self.report(dispatcher)
+
+    def report(self, dispatcher):
+        write = self.stream.write
+        write("%-14s %10s %12s %10s %10s %12s\n" % ("command", "count", "mean us", "p50 us", "p99 us", "max us"))
+        for name in sorted(self.latencies):
+            histogram = self.latencies[name]
+            write("%-14s %10d %12.2f %10s %10s %12.2f\n"
+                  % (name, histogram.count, histogram.total / histogram.count * 1e6,
+                     "<%d" % histogram.percentile(0.5), "<%d" % histogram.percentile(0.99), histogram.max * 1e6))
+        if not isinstance(dispatcher, RideDispatcher):
+            # a sharded dispatcher keeps its structures in the worker processes
+            write("structure counters are not collected for sharded runs\n")
+            return
+        counters = self.counters
+        if isinstance(dispatcher.rbt, CountingRedBlackTree):
+            write("rotations %d\n" % counters.rotations)
+        if isinstance(dispatcher.heap, CountingMinHeap):
+            write("sift up: %d calls, %d levels\n" % (counters.sift_up_calls, counters.sift_up_steps))
+            write("sift down: %d calls, %d levels, deepest %d\n"
+                  % (counters.sift_down_calls, counters.sift_down_steps, counters.max_sift_down_steps))
+            write("heap size %d (peak %d), tree height %d\n"
+                  % (dispatcher.heap.current_size, counters.max_heap_size, tree_height(dispatcher.rbt)))
+        else:
+            write("heap size %d, tree height %d\n" % (dispatcher.heap.current_size, tree_height(dispatcher.rbt)))
+        cache = dispatcher.range_cache
+        if cache is not None:
+            write("print cache: %d hits, %d misses (%.1f%% hit rate), %d invalidated, %d evicted, %d of %d bytes\n"
+                  % (cache.hits, cache.misses, 100 * cache.hit_rate(), cache.invalidations, cache.evictions,
+                     cache.bytes, cache.max_bytes))
+        if dispatcher.timers is not None:
+            write("expired %d rides in %d batches\n" % (dispatcher.expired_rides, dispatcher.expiry_batches))
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import random
+import time
+
+from gatorTaxi import (DuplicateRideError, add_aggregates_argument, add_heap_argument, add_persistence_arguments,
+                       add_print_cache_argument, is_valid_command, make_dispatcher, open_persistence, output_helper,
+                       parse_command, run_command)
+
+# Responses are terminated by an empty line, so commands without output (Insert, UpdateTrip, CancelRide) still get
+# a response and clients can match every response to its command when pipelining
+END_OF_RESPONSE = "\n"
+
+READ_CHUNK_SIZE = 65536
+
+# A response is built in memory, so GetNextRides(k) may ask for at most this many rides beyond the pending ones
+MAX_MISSING_RIDES = 10000
+
+
+# Collects the output of one command, in the same format the CLI writes to its output file
+class ResponseBuffer:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+# Serves the gatorTaxi command grammar over TCP or a Unix socket. All clients share one RideDispatcher; commands
+# run to completion on the event loop thread, so mutations from different clients are serialized without locks
+class RideServer:
+    def __init__(self, dispatcher, persistence=None):
+        self.dispatcher = dispatcher
+        self.persistence = persistence
+
+    # Run one command line, as received, and return its response, terminator included. A line that cannot be decoded
+    # or parsed, an unknown command and a wrong number of arguments are answered with Invalid Command before anything
+    # runs
+    def execute(self, line):
+        try:
+            command = parse_command(line.decode())
+        except ValueError:
+            # a non-numeric argument, or bytes that are not UTF-8 (UnicodeDecodeError is a ValueError as well)
+            command = None
+        if command is None or not is_valid_command(command[0], command[1]):
+            return "Invalid Command\n" + END_OF_RESPONSE
+        if command[0] == "GetNextRides" and command[1][0] > len(self.dispatcher) + MAX_MISSING_RIDES:
+            return "Invalid Command\n" + END_OF_RESPONSE
+        response = ResponseBuffer()
+        try:
+            run_command(command[0], command[1], self.dispatcher, response)
+        except DuplicateRideError as error:
+            # unlike a batch replay, the service keeps running after a duplicate rideNumber
+            output_helper(response, None, str(error), False)
+        if self.persistence is not None:
+            # the mutation is logged before the client sees its response
+            self.persistence.after_command()
+        return response.getvalue() + END_OF_RESPONSE
+
+    async def handle_client(self, reader, writer):
+        pending = b""
+        try:
+            while True:
+                # read whatever the client has pipelined so far and answer every complete line in one write
+                chunk = await reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                *lines, pending = (pending + chunk).split(b"\n")
+                responses = [self.execute(line) for line in lines if line.strip()]
+                if responses:
+                    writer.write("".join(responses).encode())
+                    await writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=None, port=None, unix_path=None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+# One load-test client: sends `commands` random commands keeping up to `depth` of them in flight, and records the
+# latency of each one from the moment it was sent until its response arrived
+async def load_test_client(client_id, commands, depth, connect, latencies):
+    reader, writer = await connect()
+    rng = random.Random(client_id)
+    # every client works on its own block of rideNumbers, so their inserts never collide
+    first_ride_number = client_id * commands + 1
+    next_ride_number = first_ride_number
+    in_flight = asyncio.Semaphore(depth)
+    send_times = []
+
+    async def receive():
+        for index in range(commands):
+            while (await reader.readline()) not in (b"\n", b""):
+                pass
+            latencies.append(time.perf_counter() - send_times[index])
+            in_flight.release()
+
+    receiver = asyncio.ensure_future(receive())
+    for _ in range(commands):
+        await in_flight.acquire()
+        choice = rng.random()
+        if choice < 0.4:
+            line = "Insert(%d,%d,%d)" % (next_ride_number, rng.randint(1, 100), rng.randint(1, 100))
+            next_ride_number += 1
+        elif choice < 0.55:
+            line = "GetNextRide()"
+        elif choice < 0.7:
+            line = "UpdateTrip(%d,%d)" % (rng.randint(first_ride_number, next_ride_number), rng.randint(1, 150))
+        elif choice < 0.8:
+            line = "CancelRide(%d)" % rng.randint(first_ride_number, next_ride_number)
+        elif choice < 0.9:
+            line = "Print(%d)" % rng.randint(first_ride_number, next_ride_number)
+        else:
+            low = rng.randint(first_ride_number, next_ride_number)
+            line = "Print(%d,%d)" % (low, low + 20)
+        send_times.append(time.perf_counter())
+        writer.write((line + "\n").encode())
+        await writer.drain()
+    await receiver
+    writer.close()
+
+
+async def load_test(args):
+    if args.unix is not None:
+        def connect():
+            return asyncio.open_unix_connection(args.unix)
+    else:
+        def connect():
+            return asyncio.open_connection(args.host, args.port)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[load_test_client(client_id, args.commands, args.depth, connect, latencies)
+                           for client_id in range(args.clients)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print("clients %d, pipeline depth %d, %d commands in %.2fs (%.0f commands/sec)"
+          % (args.clients, args.depth, len(latencies), elapsed, len(latencies) / elapsed))
+    print("latency p50 %.3f ms, p99 %.3f ms, max %.3f ms"
+          % (latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3, latencies[-1] * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gatorTaxi dispatch service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7700)
+    parser.add_argument("--unix", help="listen on / connect to this Unix socket instead of TCP")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    serve = subparsers.add_parser("serve", help="run the dispatch service")
+    serve.add_argument("--index", action="store_true", help="keep a hash index of rideNumbers")
+    add_heap_argument(serve)
+    add_aggregates_argument(serve)
+    add_print_cache_argument(serve)
+    add_persistence_arguments(serve)
+
+    load = subparsers.add_parser("loadtest", help="measure command latency against a running service")
+    load.add_argument("--clients", type=int, default=8)
+    load.add_argument("--commands", type=int, default=10000, help="commands sent by each client")
+    load.add_argument("--depth", type=int, default=16, help="commands each client keeps in flight")
+
+    args = parser.parse_args()
+    if args.mode == "serve":
+        dispatcher = make_dispatcher(args.index, args.heap, args.aggregates, args.print_cache)
+        persistence = open_persistence(args, dispatcher)
+        try:
+            asyncio.run(RideServer(dispatcher, persistence).serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if persistence is not None:
+                persistence.checkpoint()
+                persistence.close()
+    else:
+        asyncio.run(load_test(args))
+
+
+if __name__ == "__main__":
+    main()
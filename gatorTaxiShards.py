@@ -0,0 +1,298 @@
+import heapq
+import multiprocessing
+from itertools import islice
+
+from gatorTaxi import DuplicateRideError, Ride, make_dispatcher
+
+# Operations a shard applies, sent in batches as tuples whose first element is one of these codes
+INSERT, UPDATE, CANCEL, GET, RANGE, POP, PEEK, POP_MANY, CANCEL_RANGE, COUNT, RANK, SELECT, STATS, TICK = range(14)
+
+# Batches a shard may have in flight before the coordinator waits for a reply; bounds the data queued in the pipes
+MAX_OUTSTANDING_BATCHES = 8
+MAX_BATCH_SIZE = 4096
+
+
+# Main loop of a shard process: applies batches of operations to its own RideDispatcher and answers each batch with
+# the results of its queries, the rideNumber of a duplicate insert if there was one, and the shard's current minimum
+# ordering key so the coordinator can merge the shard minima
+def shard_worker(connection, indexed, heap, aggregates):
+    dispatcher = make_dispatcher(indexed, heap, aggregates)
+    while True:
+        batch = connection.recv()
+        if batch is None:
+            break
+        results = []
+        duplicate = None
+        try:
+            for operation in batch:
+                code = operation[0]
+                if code == INSERT:
+                    dispatcher.insert_ride(Ride(operation[1], operation[2], operation[3]),
+                                           operation[4] if len(operation) > 4 else None)
+                elif code == UPDATE:
+                    dispatcher.update_ride(operation[1], operation[2])
+                elif code == CANCEL:
+                    dispatcher.cancel_ride(operation[1])
+                elif code == GET:
+                    results.append(ride_tuple(dispatcher.get_ride(operation[1])))
+                elif code == RANGE:
+                    results.append([ride_tuple(ride)
+                                    for ride in dispatcher.iter_rides_in_range(operation[1], operation[2],
+                                                                               operation[3])])
+                elif code == POP:
+                    results.append(ride_tuple(dispatcher.get_next_ride()))
+                elif code == PEEK:
+                    results.append([ride_tuple(ride) for ride in dispatcher.peek_rides(operation[1])])
+                elif code == POP_MANY:
+                    results.append([ride_tuple(ride) for ride in dispatcher.get_next_rides(operation[1])])
+                elif code == CANCEL_RANGE:
+                    dispatcher.cancel_range(operation[1], operation[2])
+                elif code == COUNT:
+                    results.append(len(dispatcher) if len(operation) == 1
+                                   else dispatcher.count_rides(operation[1], operation[2]))
+                elif code == RANK:
+                    results.append(dispatcher.rank_ride(operation[1]))
+                elif code == SELECT:
+                    results.append(ride_tuple(dispatcher.select_ride(operation[1])))
+                elif code == STATS:
+                    results.append(dispatcher.range_stats(operation[1], operation[2]))
+                elif code == TICK:
+                    dispatcher.advance_clock(operation[1])
+        except DuplicateRideError as error:
+            duplicate = error.ride_number
+        top = dispatcher.heap.top()
+        top = None if top is None else top.key
+        connection.send((results, duplicate, top))
+    connection.close()
+
+
+def ride_tuple(ride):
+    return None if ride is None else (ride.rideNumber, ride.rideCost, ride.tripDuration)
+
+
+# The coordinator's handle on one shard process. Operations are queued locally and shipped in batches; replies are
+# collected only when the coordinator needs a result, so shards keep working while the coordinator routes commands
+class Shard:
+    def __init__(self, indexed, heap, aggregates):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=shard_worker, args=(child_connection, indexed, heap, aggregates),
+                                               daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.pending = []
+        self.outstanding = 0
+        # the coordinator's clock as last sent to the shard
+        self.clock = 0
+        # minimum ordering key and query results, as of the last reply
+        self.top = None
+        self.results = []
+
+    def queue(self, operation):
+        self.pending.append(operation)
+        if len(self.pending) >= MAX_BATCH_SIZE:
+            self.send()
+
+    def send(self):
+        if self.pending:
+            if self.outstanding >= MAX_OUTSTANDING_BATCHES:
+                self.receive()
+            self.connection.send(self.pending)
+            self.pending = []
+            self.outstanding += 1
+
+    # Wait for the reply to the oldest batch in flight
+    def receive(self):
+        self.results, duplicate, self.top = self.connection.recv()
+        self.outstanding -= 1
+        if duplicate is not None:
+            raise DuplicateRideError(duplicate)
+
+    # Wait until every queued operation has been applied; afterwards results holds the results of the queries in
+    # the last batch
+    def collect(self):
+        self.send()
+        while self.outstanding:
+            self.receive()
+
+    def close(self):
+        self.connection.send(None)
+        self.process.join()
+        self.connection.close()
+
+
+# A RideDispatcher look-alike that partitions rides by rideNumber range across worker processes, each owning its own
+# heap and red-black tree. Point operations are routed to the owning shard, range prints are scattered to the
+# overlapping shards and gathered in order, and GetNextRide pops from the shard whose minimum is the smallest.
+#
+# Insert, UpdateTrip and CancelRide are applied asynchronously and return None; a duplicate rideNumber surfaces as
+# DuplicateRideError from the next call that produces a result, or from sync(). No output can be produced in between,
+# so the output of a run is the same as with a single RideDispatcher. Rides with equal cost and duration in different
+# shards are popped lowest rideNumber range first, where a single heap breaks such ties by insertion history.
+#
+# The logical clock is kept by the coordinator. Once a ride with a TTL was inserted, a shard is sent the clock ahead
+# of its next operation and on every sync, so it expires its rides before anything can observe them
+class ShardedDispatcher:
+    def __init__(self, shard_count, key_space, indexed=False, heap="binary", aggregates=False):
+        # shard i owns rideNumbers [i * width, (i + 1) * width); the first and last shards also own everything
+        # below and above the key space
+        self.width = -(-key_space // shard_count)
+        self.shards = [Shard(indexed, heap, aggregates) for _ in range(shard_count)]
+        self.clock = 0
+        self.expiring = False
+        # rides expire inside the shards without the coordinator seeing them go, so Print results are not cached
+        self.range_cache = None
+
+    def shard_index(self, ride_number):
+        return min(max(ride_number // self.width, 0), len(self.shards) - 1)
+
+    def shard_for(self, ride_number):
+        return self.shards[self.shard_index(ride_number)]
+
+    # Queue an operation on a shard, behind the current clock if the shard has not seen it yet
+    def queue(self, shard, operation):
+        self.__catch_up(shard)
+        shard.queue(operation)
+
+    def __catch_up(self, shard):
+        if self.expiring and shard.clock != self.clock:
+            shard.clock = self.clock
+            shard.queue((TICK, self.clock))
+
+    # Apply every queued operation on every shard, first catching every shard up with the clock
+    def sync(self):
+        for shard in self.shards:
+            self.__catch_up(shard)
+            shard.send()
+        for shard in self.shards:
+            shard.collect()
+
+    def insert_ride(self, ride, ttl=None):
+        operation = (INSERT, ride.rideNumber, ride.rideCost, ride.tripDuration)
+        if ttl is not None:
+            self.expiring = True
+            operation += (ttl,)
+        self.queue(self.shard_for(ride.rideNumber), operation)
+
+    # One tick of the logical clock, see RideDispatcher.tick; the shards are caught up lazily
+    def tick(self):
+        self.clock += 1
+
+    def update_ride(self, ride_number, new_duration):
+        self.queue(self.shard_for(ride_number), (UPDATE, ride_number, new_duration))
+
+    def cancel_ride(self, ride_number):
+        self.queue(self.shard_for(ride_number), (CANCEL, ride_number))
+
+    def get_ride(self, ride_number):
+        shard = self.shard_for(ride_number)
+        self.queue(shard, (GET, ride_number))
+        self.sync()
+        ride = shard.results[-1]
+        return None if ride is None else Ride(*ride)
+
+    def get_next_ride(self):
+        # k-way merge of the shard minima: every shard reports its minimum key with each reply
+        self.sync()
+        best = None
+        for shard in self.shards:
+            if shard.top is not None and (best is None or shard.top < best.top):
+                best = shard
+        if best is None:
+            return None
+        self.queue(best, (POP,))
+        best.collect()
+        return Ride(*best.results[-1])
+
+    def cancel_range(self, low, high):
+        if low <= high:
+            for shard in self.shards[self.shard_index(low):self.shard_index(high) + 1]:
+                self.queue(shard, (CANCEL_RANGE, low, high))
+
+    def get_next_rides(self, k):
+        # the k cheapest rides overall are each shard's own cheapest few: find out how many each shard contributes,
+        # pop that many from every shard and merge them back into one order
+        counts = {}
+        for ride in self.__peek(k):
+            shard = self.shard_for(ride[0])
+            counts[shard] = counts.get(shard, 0) + 1
+        popping = [shard for shard in self.shards if shard in counts]
+        for shard in popping:
+            self.queue(shard, (POP_MANY, counts[shard]))
+        self.sync()
+        rides = heapq.merge(*[shard.results[-1] for shard in popping], key=lambda ride: (ride[1], ride[2]))
+        return [Ride(*ride) for ride in rides]
+
+    def peek_rides(self, k):
+        return [Ride(*ride) for ride in self.__peek(k)]
+
+    # The k cheapest rides across the shards, as tuples, merged from every shard's own k cheapest
+    def __peek(self, k):
+        # every shard reports its own k cheapest rides, the k cheapest of all are among them
+        for shard in self.shards:
+            self.queue(shard, (PEEK, k))
+        self.sync()
+        rides = heapq.merge(*[shard.results[-1] for shard in self.shards], key=lambda ride: (ride[1], ride[2]))
+        return list(islice(rides, max(k, 0)))
+
+    def count_rides(self, low, high):
+        overlapping = self.shards[self.shard_index(low):self.shard_index(high) + 1] if low <= high else []
+        for shard in overlapping:
+            self.queue(shard, (COUNT, low, high))
+        self.sync()
+        return sum(shard.results[-1] for shard in overlapping)
+
+    # The number of rides in every shard, a bare COUNT counts them all
+    def __shard_sizes(self):
+        for shard in self.shards:
+            self.queue(shard, (COUNT,))
+        self.sync()
+        return [shard.results[-1] for shard in self.shards]
+
+    def rank_ride(self, ride_number):
+        # every ride in a lower shard has a smaller rideNumber
+        index = self.shard_index(ride_number)
+        sizes = self.__shard_sizes()
+        shard = self.shards[index]
+        self.queue(shard, (RANK, ride_number))
+        shard.collect()
+        rank = shard.results[-1]
+        return rank + sum(sizes[:index]) if rank else 0
+
+    def select_ride(self, i):
+        if i < 1:
+            return None
+        for shard, size in zip(self.shards, self.__shard_sizes()):
+            if i <= size:
+                self.queue(shard, (SELECT, i))
+                shard.collect()
+                return Ride(*shard.results[-1])
+            i -= size
+        return None
+
+    def range_stats(self, low, high):
+        overlapping = self.shards[self.shard_index(low):self.shard_index(high) + 1] if low <= high else []
+        for shard in overlapping:
+            self.queue(shard, (STATS, low, high))
+        self.sync()
+        parts = [shard.results[-1] for shard in overlapping if shard.results[-1][0]]
+        if not parts:
+            return 0, 0, 0, 0, 0, 0, 0
+        return (sum(part[0] for part in parts), sum(part[1] for part in parts), min(part[2] for part in parts),
+                max(part[3] for part in parts), sum(part[4] for part in parts), min(part[5] for part in parts),
+                max(part[6] for part in parts))
+
+    def iter_rides_in_range(self, low, high, limit=None, offset=0):
+        # every shard returns at most offset + limit rides, the page is cut from the ordered concatenation
+        shard_limit = None if limit is None else offset + limit
+        overlapping = self.shards[self.shard_index(low):self.shard_index(high) + 1] if low <= high else []
+        for shard in overlapping:
+            self.queue(shard, (RANGE, low, high, shard_limit))
+        self.sync()
+        rides = (Ride(*ride) for shard in overlapping for ride in shard.results[-1])
+        if limit is not None or offset:
+            rides = islice(rides, offset, shard_limit)
+        return rides
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()